@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 # pyright: reportUnusedVariable=false, reportGeneralTypeIssues=false
+import asyncio
 import locale
 import logging
 import json
 import os
+import time
 from telegram import __version__ as TG_VER
 from telegram import CallbackQuery, Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
@@ -11,68 +13,29 @@ from telegram.error import BadRequest
 from cdp import Cdp, Wallet, WalletData, wallet
 import re
 from decimal import Decimal
-from replit import db
 from web3 import Web3
-import requests
 from web3 import Account
 import httpx
-# Add the minimal ERC20 ABI for decimals()
-ERC20_ABI = [{
-    "constant": True,
-    "inputs": [],
-    "name": "decimals",
-    "outputs": [{
-        "name": "",
-        "type": "uint8"
-    }],
-    "payable": False,
-    "stateMutability": "view",
-    "type": "function"
-}, {
-    "constant":
-    False,
-    "inputs": [{
-        "name": "_spender",
-        "type": "address"
-    }, {
-        "name": "_value",
-        "type": "uint256"
-    }],
-    "name":
-    "approve",
-    "outputs": [{
-        "name": "",
-        "type": "bool"
-    }],
-    "payable":
-    False,
-    "stateMutability":
-    "nonpayable",
-    "type":
-    "function"
-}, {
-    "constant":
-    True,
-    "inputs": [{
-        "name": "_owner",
-        "type": "address"
-    }, {
-        "name": "_spender",
-        "type": "address"
-    }],
-    "name":
-    "allowance",
-    "outputs": [{
-        "name": "",
-        "type": "uint256"
-    }],
-    "payable":
-    False,
-    "stateMutability":
-    "view",
-    "type":
-    "function"
-}]
+from src.callback_router import CallbackRouter
+from src.allowance_cache import AllowanceCache
+from src.cdp_executor import CdpExecutor
+from src.fee_oracle import FeeOracle, gas_limit
+from src.conversation import ConversationState, conversation_for
+from src.http_client import create_http_client
+from src.multicall import ReadBatch
+from src.nonce_manager import NonceManager
+from src.persistence import SqlitePersistence
+from src.price_feed import PriceFeed
+from src.price_service import PriceService
+from src.quote_cache import QuoteCache
+from src.quote_engine import QuoteEngine, QuoteError
+from src.rpc_pool import RpcPool
+from src.settlement import SettlementTracker
+from src.storage import CachedStore, ReplitStore, SqliteStore, open_store
+from src.token_metadata import TokenMetadataCache
+from src.update_processor import PerUserUpdateProcessor
+from src.wallet_cache import WalletSessionCache
+from src.wallet_pool import WalletPool
 GREEN = "\033[92m"
 RED = "\033[91m"
 RESET = "\033[0m"
@@ -99,6 +62,16 @@ def format_number(num):
         return formatted_number
 
 
+def format_usd(*factors):
+    """Dollar value of the product of ``factors``, or n/a if one is missing."""
+    if any(factor is None for factor in factors):
+        return "n/a"
+    value = 1.0
+    for factor in factors:
+        value *= float(factor)
+    return f"${format_number(value)}"
+
+
 user_bot_name = "Velvet_Unicorn_bot"
 
 try:
@@ -128,123 +101,214 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+# Comma-separated Base RPC endpoints, tried in order with failover.
+BASE_RPC_URLS = os.environ.get(
+    'BASE_RPC_URLS',
+    'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
+).split(',')
+rpc_pool = RpcPool(BASE_RPC_URLS,
+                   max_concurrency=int(
+                       os.environ.get('RPC_MAX_CONCURRENCY', '32')),
+                   request_timeout=float(os.environ.get('RPC_TIMEOUT', '10')))
+token_metadata = TokenMetadataCache(
+    os.environ.get('TOKEN_METADATA_PATH', 'token_metadata.json'))
+# Encrypted wallet records per Telegram user: "sqlite:///path.db" or "replit:"
+wallet_store = CachedStore(
+    open_store(os.environ.get('WALLET_STORE_URL', 'sqlite:///wallets.db')),
+    max_size=int(os.environ.get('WALLET_STORE_CACHE_SIZE', '10000')))
+# Ready-made wallets kept for new users; 0 disables the pool. It needs the
+# SQLite wallet store, which can claim a pooled record atomically
+WALLET_POOL_SIZE = int(os.environ.get('WALLET_POOL_SIZE', '20'))
+wallet_pool = None
+wallet_sessions = WalletSessionCache(
+    max_size=int(os.environ.get('WALLET_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('WALLET_CACHE_TTL', '900')))
+# The CDP SDK is synchronous; keep its network calls off the event loop
+cdp_executor = CdpExecutor(
+    max_workers=int(os.environ.get('CDP_MAX_WORKERS', '16')))
+price_service = PriceService(
+    "https://graph.defined.fi/graphql",
+    os.environ.get('CODEX_API_KEY', "e1d573dd2d5992e65c8fc67cb73dca5229e4aca5"),
+    token_metadata=token_metadata,
+    ttl=float(os.environ.get('PRICE_CACHE_TTL', '10')))
+# Optional background refresh of trending and held tokens; 0 disables it
+price_feed = PriceFeed(price_service,
+                       interval=float(os.environ.get('PRICE_FEED_INTERVAL',
+                                                     '0')),
+                       top_n=int(os.environ.get('PRICE_FEED_TOP_N', '50')))
+# Upper bound for each independent stage of the positions view
+POSITIONS_STAGE_TIMEOUT = float(os.environ.get('POSITIONS_STAGE_TIMEOUT', '5'))
+# Tokens shown per positions page, and how long page flips reuse the snapshot
+POSITIONS_PAGE_SIZE = int(os.environ.get('POSITIONS_PAGE_SIZE', '5'))
+POSITIONS_SNAPSHOT_TTL = float(os.environ.get('POSITIONS_SNAPSHOT_TTL', '60'))
+settlement_tracker = SettlementTracker(
+    rpc_pool,
+    poll_interval=float(os.environ.get('SETTLEMENT_POLL_INTERVAL', '2')))
+callback_router = CallbackRouter()
+# Quotes are cached briefly so the amount buttons can use prefetched ones
+quote_cache = QuoteCache('https://metasolvertest.velvetdao.xyz/best-quotes',
+                         ttl=float(os.environ.get('QUOTE_CACHE_TTL', '15')))
+QUOTE_PREFETCH = os.environ.get('QUOTE_PREFETCH', '1') == '1'
+# Nonces for transactions signed here are handed out locally, per wallet
+nonce_manager = NonceManager(rpc_pool)
+fee_oracle = FeeOracle(
+    rpc_pool, interval=float(os.environ.get('FEE_ORACLE_INTERVAL', '2')))
+allowance_cache = AllowanceCache(
+    ttl=float(os.environ.get('ALLOWANCE_CACHE_TTL', '600')))
+# Gas limit for swaps is the quote's gasEstimate times this margin
+GAS_LIMIT_MARGIN = float(os.environ.get('GAS_LIMIT_MARGIN', '1.5'))
+# Comma-separated extra slippages (e.g. "1,3") quoted alongside the user's
+quote_engine = QuoteEngine(
+    rpc_pool,
+    price_service,
+    quote_cache,
+    token_metadata,
+    nonce_manager,
+    fee_oracle,
+    allowance_cache,
+    settlement_tracker,
+    "0xfDAc2748713906ede00D023AA3E0Cc893828D30B",
+    slippage_levels=[
+        level for level in os.environ.get('QUOTE_SLIPPAGE_LEVELS', '').split(',')
+        if level
+    ],
+    # Unlimited router approvals: one approve per token instead of per sell
+    approve_max=os.environ.get('APPROVE_MAX') == '1')
+# Shared client for metasolver, tbotserver and Codex; opened in post_init
+http_client: httpx.AsyncClient = None
+# Amount buttons on the trade screen: percent of balance, and fixed ETH amounts
+AMOUNT_PERCENT_PRESETS = (25, 50, 75, 100)
+AMOUNT_ETH_PRESETS = ('0.05', '0.1', '0.3', '0.5')
+# Pending text prompts (amount, address, ...) are dropped after this long
+CONVERSATION_TTL = float(os.environ.get('CONVERSATION_TTL', '600'))
+
+
+def match_market_details(array1, array2, keep_unmatched=False):
+    """
+    Pair each wallet token with its market details. Tokens without market
+    details are dropped, or paired with None if ``keep_unmatched``.
+    """
+    # Index market details by normalized address so matching is a single pass
+    market_by_address = {
+        item1['token']['address'].lower(): item1
+        for item1 in array1
+    }
+    matches = []
+    for item2 in array2:
+        token_address = item2['tokenAddress'].lower()
+        if token_address == '0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee':
+            token_address = '0x4200000000000000000000000000000000000006'
+        item1 = market_by_address.get(token_address)
+        if item1 is not None or keep_unmatched:
+            matches.append((item1, item2))
+    return matches
+
+
+def position_entry(item1, item2, balance):
+    """One position; market fields are None when ``item1`` is missing."""
+    market = item1 or {}
+    return {
+        'tokenAddress': item2['tokenAddress'],
+        'tokenName': item2['tokenName'],
+        'oldPrice': item2['tokenAmount'],
+        'newPrice': market.get('priceUSD'),
+        "marketCap": market.get('marketCap'),
+        "liquidity": market.get('liquidity'),
+        "holders": market.get('holders'),
+        "change1": market.get('change1'),
+        "change24": market.get('change24'),
+        "balance": None if balance is None else str(balance)
+    }
+
 
-async def merge_token_arrays(array1, array2, update):
+async def merge_token_arrays(array1, array2, update, keep_unpriced=False):
     """
     Merge two arrays dynamically to create a new array with specified fields.
 
     :param array1: List of tokens with market details
     :param array2: List of tokens with wallet details
+    :param keep_unpriced: Keep tokens missing from ``array1``, without prices
     :return: Merged list of tokens
     """
     merged_array = []
 
-    w3 = Web3(
-        Web3.HTTPProvider(
-            'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-        ))
     wallet = await get_or_create_address(update)
     owner_address = wallet.address_id
 
-    for item2 in array2:
-        for item1 in array1:
-            # Match tokens based on token address
-            token_address = item2['tokenAddress'].lower()
-            if token_address == '0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee':
-                token_address = '0x4200000000000000000000000000000000000006'
-            if token_address == item1['token']['address'].lower():
-
-                if item2['tokenAddress'].lower(
-                ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                    balance_wei = w3.eth.get_balance(
-                        Web3.to_checksum_address(owner_address)
-                    )  # Use the owner's address for ETH balance
-                    balance = w3.from_wei(balance_wei, 'ether')
-                else:
-                    balance = Decimal(
-                        wallet.balance(
-                            Web3.to_checksum_address(item2['tokenAddress'])))
-
-                merged_array.append({
-                    'tokenAddress': item2['tokenAddress'],
-                    'tokenName': item2['tokenName'],
-                    'oldPrice': item2['tokenAmount'],
-                    'newPrice': item1['priceUSD'],
-                    "marketCap": item1['marketCap'],
-                    "liquidity": item1['liquidity'],
-                    "holders": item1['holders'],
-                    "change1": item1['change1'],
-                    "change24": item1['change24'],
-                    "balance": str(balance)
-                })
-
-    # Filter out zero balance items from merged_array
-    filtered_array = [
-        item for item in merged_array if float(item['balance']) != 0
-    ]
-
-    return filtered_array
-
+    matches = match_market_details(array1, array2, keep_unpriced)
 
-def fetch_price_from_codex(tokens, chain):
+    # Fetch every balance (and any unknown decimals) in one Multicall round trip
+    reads = ReadBatch(rpc_pool)
+    balance_reads = []
+    for _, item2 in matches:
+        if item2['tokenAddress'].lower(
+        ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
+            # Use the owner's address for ETH balance
+            balance_read = reads.eth_balance(owner_address)
+        else:
+            balance_read = reads.balance_of(item2['tokenAddress'],
+                                            owner_address)
+        decimals_read = token_metadata.read_decimals(reads,
+                                                     item2['tokenAddress'])
+        balance_reads.append((balance_read, decimals_read))
+    await reads.execute()
+
+    for (item1, item2), (balance_read, decimals_read) in zip(matches,
+                                                            balance_reads):
+        # Filter out zero balances before any price math
+        if not balance_read.value or decimals_read.value is None:
+            continue
+        balance = Decimal(balance_read.value) / Decimal(10**
+                                                        decimals_read.value)
+        merged_array.append(position_entry(item1, item2, balance))
+
+    return merged_array
+
+
+async def fetch_price_from_codex(tokens, chain):
     print(f"🚀 ~ fetch_price_from_codex ~ tokens: {tokens}, chain: {chain}")
-    try:
-        # Format tokens as a string suitable for the GraphQL query
-        token_inputs = '\n'.join([f'"{token}"' for token in tokens])
-        print(f"🚀 ~ fetch_price_from_codex ~ tokenInputs: {token_inputs}")
-
-        # GraphQL query
-        query = f"""
-        query {{
-          filterTokens(
-            tokens: [{token_inputs}],
-            limit: 200
-          ) {{
-            results {{
-              token {{
-                address
-                decimals
-                name
-                networkId
-                symbol
-              }}
-              marketCap
-              holders
-              priceUSD
-              liquidity
-              change1
-              change24
-              createdAt
-            }}
-          }}
-        }}
-        """
-
-        # Request headers
-        headers = {
-            "Authorization": "e1d573dd2d5992e65c8fc67cb73dca5229e4aca5",
-            "Content-Type": "application/json",
-        }
-
-        # Make the POST request
-        response = requests.post(
-            "https://graph.defined.fi/graphql",
-            json={"query": query},
-            headers=headers,
-        )
-
-        # Raise an exception if the response contains an HTTP error
-        response.raise_for_status()
-
-        # Extract data from the response
-        price_data = response.json()
-        filter_tokens = price_data.get("data", {}).get("filterTokens",
-                                                       {}).get("results", [])
-        return filter_tokens
-
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch price from codex: {str(e)}")
-        return []
+    # Served from the short-TTL price cache; misses from concurrent callers
+    # are coalesced into shared filterTokens requests
+    return await price_service.get_prices(tokens)
+
+
+async def create_wallet_record(executor_key):
+    """Create a CDP wallet; return its encrypted record and default address."""
+    wallet = await cdp_executor.run(executor_key, Wallet.create,
+                                    "base-mainnet")
+    logging.info("Created new wallet")
+    wallet_data = await cdp_executor.run(executor_key, wallet.export_data)
+    logging.info("Exported wallet data")
+
+    # Generate a new IV and encrypt the wallet data
+    iv = os.urandom(16).hex()  # Generate a 16-byte IV and convert to hex
+    encrypted_data = encrypt(wallet_data.to_dict(), iv)
+    logging.info("Encrypted wallet data")
+    # default_address lists the wallet's addresses over the network
+    address = await cdp_executor.run(executor_key,
+                                     lambda: wallet.default_address)
+    return json.dumps({'encrypted': encrypted_data, 'iv': iv}), address
+
+
+async def create_pool_wallet():
+    # A key of its own, so pool wallets are created in parallel
+    record, address = await create_wallet_record(
+        f"wallet_pool:{os.urandom(8).hex()}")
+    return address.address_id, record, address
+
+
+async def import_wallet_address(user_id, encrypted_data):
+    """Decrypt a stored wallet record, import it and return its default address."""
+    stored_data = json.loads(encrypted_data)
+    logging.info("Parsed stored data")
+    decrypted_data = decrypt(stored_data['encrypted'], stored_data['iv'])
+    logging.info("Decrypted data")
+    wallet_data = WalletData.from_dict(decrypted_data)
+    logging.info("Created WalletData object")
+    wallet = await cdp_executor.run(user_id, Wallet.import_data, wallet_data)
+    logging.info("Imported wallet data")
+    # default_address lists the wallet's addresses over the network
+    return await cdp_executor.run(user_id, lambda: wallet.default_address)
 
 
 # TODO: This should be typed.
@@ -254,39 +318,48 @@ async def get_or_create_address(update: Update):
     user_id = str(update.effective_user.id)
     logging.info(f"User ID: {user_id}")
 
-    if user_id in db:
-        logging.info("User data found in db")
-        # If user data exists in db, decrypt and import the wallet
-        encrypted_data = db[user_id]
-        logging.info("Retrieved encrypted data from db")
-        stored_data = json.loads(encrypted_data)
-        logging.info("Parsed stored data")
-        decrypted_data = decrypt(stored_data['encrypted'], stored_data['iv'])
-        logging.info("Decrypted data")
-        wallet_data = WalletData.from_dict(decrypted_data)
-        logging.info("Created WalletData object")
-        wallet = Wallet.import_data(wallet_data)
-        logging.info("Imported wallet data")
+    address = wallet_sessions.get(user_id)
+    if address is not None:
+        logging.info("Returning cached wallet default address")
+        return address
+
+    encrypted_data = wallet_store.get(user_id)
+    if encrypted_data is None and wallet_pool is not None:
+        # New user: take a pre-provisioned wallet, which is already stored
+        # under the user's id once claimed
+        claimed = wallet_pool.claim(user_id)
+        if claimed is not None:
+            logging.info("Assigned a pre-provisioned wallet")
+            encrypted_data, address = claimed
+        else:
+            # Either the pool is empty or a concurrent request (another chat,
+            # another instance) has just stored this user's wallet
+            encrypted_data = wallet_store.get(user_id)
+
+    if address is not None:
+        logging.info("Using the pooled wallet's default address")
+    elif encrypted_data is not None:
+        logging.info("User data found in wallet store")
+        # If user data exists in the store, decrypt and import the wallet
+        address = await import_wallet_address(user_id, encrypted_data)
     else:
-        logging.info("User data not found in db, creating new wallet")
+        logging.info("User data not found in wallet store, creating new wallet")
         # If user data doesn't exist, create a new wallet
-        wallet = Wallet.create("base-mainnet")
-        logging.info("Created new wallet")
-        wallet_data = wallet.export_data()
-        logging.info("Exported wallet data")
-
-        # Generate a new IV and encrypt the wallet data
-        iv = os.urandom(16).hex()  # Generate a 16-byte IV and convert to hex
-        logging.info("Generated new IV")
-        encrypted_data = encrypt(wallet_data.to_dict(), iv)
-        logging.info("Encrypted wallet data")
+        record, address = await create_wallet_record(user_id)
 
-        # Save the encrypted wallet data and IV to db
-        db[user_id] = json.dumps({'encrypted': encrypted_data, 'iv': iv})
-        logging.info("Saved encrypted wallet data to db")
+        # Save the encrypted wallet data and IV to the wallet store, unless a
+        # concurrent request stored one first; never replace a stored wallet
+        if wallet_store.set_if_absent(user_id, record):
+            logging.info("Saved encrypted wallet data to wallet store")
+        else:
+            logging.warning(
+                "Another request stored a wallet for this user first; using it")
+            address = await import_wallet_address(user_id,
+                                                  wallet_store.get(user_id))
 
     logging.info("Returning wallet default address")
-    return wallet.default_address
+    wallet_sessions.put(user_id, address)
+    return address
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -348,7 +421,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "walletAddress": wallet_address,
     }
     try:
-        response = requests.post(api_url_add_user, json=add_user_payload)
+        response = await http_client.post(api_url_add_user,
+                                          json=add_user_payload)
         if response.status_code == 201:
             print("user added")
         else:
@@ -371,7 +445,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         }
 
         try:
-            response = requests.post(api_url, json=payload)
+            response = await http_client.post(api_url, json=payload)
             if response.status_code == 201:
                 await update.message.reply_text(
                     "Referral successfully recorded.")
@@ -385,7 +459,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def check_balance(update: Update) -> dict:
     """Get the balances for the wallet."""
     wallet = await get_or_create_address(update)
-    return wallet.balances()
+    return await cdp_executor.run(update.effective_user.id, wallet.balances)
 
 
 def is_valid_eth_address(address):
@@ -425,6 +499,13 @@ async def handle_button_referral(update: Update,
         parse_mode="Markdown")
 
 
+async def fetch_position_tokens(wallet_address):
+    """Fetch the tokens recorded for a wallet by tbotserver."""
+    return await http_client.get(
+        "https://tbotserver.velvetdao.xyz/get-token",
+        params={'walletAddress': wallet_address.lower()})
+
+
 async def handle_my_position(update: Update,
                              context: ContextTypes.DEFAULT_TYPE):
     """Handle the My Position button click."""
@@ -432,29 +513,58 @@ async def handle_my_position(update: Update,
 
     if not message:
         return
-    await message.reply_text("Fetching your current token positions...")
+    status_message = await message.reply_text(
+        "Fetching your current token positions...")
+    tokens_task = None
+    reply_markup = None
     try:
         # Call the API to get tokens
-        w3 = Web3(
-            Web3.HTTPProvider(
-                'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-            ))
         wallet = await get_or_create_address(update)
         wallet_address = wallet.address_id
         chain = 8453
         print(f"🚀 ~ handle_my_position ~ wallet_address: {wallet_address}")
-        balance_wei = w3.eth.get_balance(
-            Web3.to_checksum_address(
-                wallet_address))  # Use the owner's address for ETH balance
-        balance = w3.from_wei(balance_wei, 'ether')
-        chain = 8453
-        tokens = [f"0x4200000000000000000000000000000000000006:{chain}"]
-        price_data = fetch_price_from_codex(tokens, chain)
-        price = price_data[0]['priceUSD']
-        response = requests.get(
-            "https://tbotserver.velvetdao.xyz/get-token",
-            params={'walletAddress': wallet_address.lower()})
-        if response.status_code == 200:
+
+        # The ETH balance, WETH price and token list are independent: run them
+        # concurrently, each bounded by the stage timeout
+        tokens_task = asyncio.ensure_future(
+            asyncio.wait_for(fetch_position_tokens(wallet_address),
+                             POSITIONS_STAGE_TIMEOUT))
+        balance_wei, price_data = await asyncio.gather(
+            asyncio.wait_for(
+                rpc_pool.call(lambda w3: w3.eth.get_balance(
+                    Web3.to_checksum_address(wallet_address))),
+                POSITIONS_STAGE_TIMEOUT),  # Use the owner's address for ETH balance
+            asyncio.wait_for(
+                fetch_price_from_codex(
+                    [f"0x4200000000000000000000000000000000000006:{chain}"],
+                    chain), POSITIONS_STAGE_TIMEOUT),
+            return_exceptions=True)
+        # A stage that timed out leaves its fields missing instead of failing
+        # the whole screen
+        for result in (balance_wei, price_data):
+            if isinstance(result, BaseException) and not isinstance(
+                    result, asyncio.TimeoutError):
+                raise result
+        balance = None
+        if not isinstance(balance_wei, BaseException):
+            balance = Web3.from_wei(balance_wei, 'ether')
+        price = None
+        if not isinstance(price_data, BaseException) and price_data:
+            price = price_data[0]['priceUSD']
+        header = (f"Wallet: `{wallet_address}`\n\n"
+                  f"ETH Balance:`{'n/a' if balance is None else balance}` ETH "
+                  f"({format_usd(balance, price)}) \n\n")
+        # Show the ETH balance while the token list is still loading
+        await status_message.edit_text(header + "Loading token positions...",
+                                       parse_mode='Markdown')
+
+        try:
+            response = await tokens_task
+        except asyncio.TimeoutError:
+            response = None
+        if response is None:
+            messages = header + "Timed out loading token positions, please refresh."
+        elif response.status_code == 200:
             data = response.json()
             print(data)
             tokens = data.get('tokens', [])
@@ -466,41 +576,132 @@ async def handle_my_position(update: Update,
             ]
             print(
                 f"🚀 ~ handle_my_position ~ token_addresses: {token_addresses}")
-            price_data = fetch_price_from_codex(token_addresses, chain)
+            price_feed.record_positions(token_addresses)
+            missing = []
+            try:
+                price_data = await asyncio.wait_for(
+                    fetch_price_from_codex(token_addresses, chain),
+                    POSITIONS_STAGE_TIMEOUT)
+            except asyncio.TimeoutError:
+                price_data = []
+                missing.append("prices")
             print(f"🚀 ~ handle_my_position ~ price_data: {price_data}")
-            merge_array = await merge_token_arrays(price_data, tokens, update)
+            try:
+                merge_array = await asyncio.wait_for(
+                    merge_token_arrays(price_data,
+                                       tokens,
+                                       update,
+                                       keep_unpriced=bool(missing)),
+                    POSITIONS_STAGE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Without balances, list every token the wallet has held
+                merge_array = [
+                    position_entry(item1, item2, None)
+                    for item1, item2 in match_market_details(
+                        price_data, tokens, keep_unmatched=True)
+                ]
+                missing.append("balances")
             print(f"🚀 ~ handle_my_position ~ merge_array: {merge_array}")
-
-            if merge_array:
-                messages = (
-                    f"Wallet: `{wallet_address}`\n\n"
-                    f"ETH Balance:`{balance}` ETH (${format_number(float(balance) * float(price))}) \n\n"
-                )
-                for token in merge_array:
-                    # Skip if the tokenAddress is "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
-                    if token[
-                            'tokenAddress'] == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                        continue
-                    messages += (
-                        f"{token['tokenName']} -"
-                        f"[📈](https://www.dextools.io/app/en/base/pair-explorer/{token['tokenAddress']})"
-                        f"**{round(float(token['balance']),6)} (${format_number(float(token['balance']) * float(token['newPrice']))})**\n"
-                        f"• `{token['tokenAddress']}`\n"
-                        f"• Price & MC: **${format_number(float(token['newPrice']))}** — **${format_number(token['marketCap'])}** \n"
-
-                        # — **{format_number(token['liquidity'])}**
-                        f"• Average entry: **${format_number((float(token['oldPrice']) + float(token['newPrice'])) /2)}** — **${format_number(token['marketCap'])}**\n"
-                        f"• Liquidity: ${format_number(token['liquidity'])}\n\n\n"
-                    )
+            if missing:
+                header += (f"_Timed out loading {' and '.join(missing)}, "
+                           f"shown as n/a._\n\n")
+
+            # Skip if the tokenAddress is "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+            positions = [
+                token for token in merge_array if token['tokenAddress'] !=
+                "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+            ]
+            if positions:
+                # Page flips re-render from this snapshot instead of refetching
+                context.user_data['positions_snapshot'] = {
+                    'created_at': time.time(),
+                    'header': header,
+                    'positions': positions,
+                }
+                messages, reply_markup = render_positions_page(
+                    context.user_data['positions_snapshot'], 0)
             else:
-                messages = "No current positions found."
+                messages = header + "No current positions found."
         else:
             messages = f"Error: {response.json().get('error', 'Unknown error')}"
 
+    except asyncio.TimeoutError:
+        messages = "Timed out fetching token details, please try again."
     except Exception as e:
         messages = f"Error fetching token details: {str(e)}"
+    finally:
+        if tokens_task is not None and not tokens_task.done():
+            tokens_task.cancel()
+
+    await status_message.edit_text(messages,
+                                   parse_mode='Markdown',
+                                   reply_markup=reply_markup)
+
+
+def render_positions_page(snapshot, page):
+    """Render one page of a positions snapshot with prev/next buttons."""
+    positions = snapshot['positions']
+    page_count = max(1, -(-len(positions) // POSITIONS_PAGE_SIZE))
+    page = min(max(page, 0), page_count - 1)
+
+    messages = snapshot['header']
+    start = page * POSITIONS_PAGE_SIZE
+    for token in positions[start:start + POSITIONS_PAGE_SIZE]:
+        balance = token['balance']
+        new_price = token['newPrice']
+        average_entry = None
+        if new_price is not None:
+            average_entry = (float(token['oldPrice']) + float(new_price)) / 2
+        messages += (
+            f"{token['tokenName']} -"
+            f"[📈](https://www.dextools.io/app/en/base/pair-explorer/{token['tokenAddress']})"
+            f"**{'n/a' if balance is None else round(float(balance),6)} ({format_usd(balance, new_price)})**\n"
+            f"• `{token['tokenAddress']}`\n"
+            f"• Price & MC: **{format_usd(new_price)}** — **{format_usd(token['marketCap'])}** \n"
+
+            # — **{format_number(token['liquidity'])}**
+            f"• Average entry: **{format_usd(average_entry)}** — **{format_usd(token['marketCap'])}**\n"
+            f"• Liquidity: {format_usd(token['liquidity'])}\n\n\n")
+
+    navigation = []
+    if page > 0:
+        navigation.append(
+            InlineKeyboardButton("◀️ Prev",
+                                 callback_data=f"pos:page:{page - 1}"))
+    navigation.append(
+        InlineKeyboardButton(f"{page + 1}/{page_count}",
+                             callback_data=f"pos:page:{page}"))
+    if page < page_count - 1:
+        navigation.append(
+            InlineKeyboardButton("Next ▶️",
+                                 callback_data=f"pos:page:{page + 1}"))
+    keyboard = [
+        navigation,
+        [InlineKeyboardButton("🔄 Refresh", callback_data='my_position')],
+    ]
+    return messages, InlineKeyboardMarkup(keyboard)
 
-    await message.reply_text(messages, parse_mode='Markdown')
+
+async def handle_positions_page(update: Update,
+                                context: ContextTypes.DEFAULT_TYPE,
+                                page: int) -> None:
+    """Flip the positions view to another page from the cached snapshot."""
+    query = update.callback_query
+    snapshot = context.user_data.get('positions_snapshot')
+    if not snapshot or time.time(
+    ) - snapshot['created_at'] > POSITIONS_SNAPSHOT_TTL:
+        await handle_my_position(update, context)
+        return
+
+    messages, reply_markup = render_positions_page(snapshot, page)
+    try:
+        await query.edit_message_text(messages,
+                                      parse_mode='Markdown',
+                                      reply_markup=reply_markup)
+    except BadRequest as e:
+        # Tapping the current page label leaves the message unchanged
+        if 'not modified' not in str(e):
+            raise
 
 
 async def handle_button_check_balance(
@@ -561,7 +762,7 @@ async def handle_button_withdraw_eth(
         return
     await message.reply_text("How much ETH would you like to withdraw?",
                              reply_markup=ForceReply())
-    context.user_data['awaiting_withdraw_amount'] = True
+    expect_input(context, ConversationState.WITHDRAW_AMOUNT)
 
 
 async def handle_button_export_key(update: Update,
@@ -580,6 +781,8 @@ async def handle_button_export_key(update: Update,
         await message.reply_text(f"`{private_key}`", parse_mode='MarkdownV2')
     except Exception as e:
         await message.reply_text(f"Error exporting private key: {str(e)}")
+    finally:
+        wallet_sessions.invalidate(str(update.effective_user.id))
 
 
 async def handle_button_pin_message(
@@ -599,7 +802,7 @@ async def handle_button_buy(query: CallbackQuery,
     await query.message.reply_text(
         "How much ETH would you like to spend on the buy?",
         reply_markup=ForceReply())
-    context.user_data['awaiting_buy_amount'] = True
+    expect_input(context, ConversationState.BUY_AMOUNT)
 
 
 async def handle_button_sell(query: CallbackQuery,
@@ -608,7 +811,7 @@ async def handle_button_sell(query: CallbackQuery,
     await query.message.reply_text(
         "Which asset would you like to sell? (contract address)",
         reply_markup=ForceReply())
-    context.user_data['awaiting_sell_asset'] = True
+    expect_input(context, ConversationState.SELL_ASSET)
 
 
 async def handle_trade_no(update: Update, query: CallbackQuery) -> None:
@@ -654,71 +857,96 @@ async def handle_trade_no(update: Update, query: CallbackQuery) -> None:
 
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles button press and sends a new message."""
+    """Handles button press and dispatches it through the callback router."""
     query = update.callback_query
     await query.answer()
 
-    if query.data == 'check_balance':
-        await handle_button_check_balance(update, context)
-    elif query.data == 'referral':
-        await handle_button_referral(update, context)
-    elif query.data == 'trade':
-        await handle_button_trade(update, context)
-    elif query.data == '25_amount':
-        await handle_amount_to_trade(update, context, query, 25)
-    elif query.data == '50_amount':
-        await handle_amount_to_trade(update, context, query, 50)
-    elif query.data == '75_amount':
-        await handle_amount_to_trade(update, context, query, 75)
-    elif query.data == '100_amount':
-        await handle_amount_to_trade(update, context, query, 100)
-    elif query.data == '0.05_amount':
-        await handle_amount_to_trade_number(update, context, query, 0.05)
-    elif query.data == '0.1_amount':
-        await handle_amount_to_trade_number(update, context, query, 0.1)
-    elif query.data == '0.3_amount':
-        await handle_amount_to_trade_number(update, context, query, 0.3)
-    elif query.data == '0.5_amount':
-        await handle_amount_to_trade_number(update, context, query, 0.5)
-    elif query.data == '5_slippage':
-        await handle_slippage(update, context, 5)
-    elif query.data == '3_slippage':
-        await handle_slippage(update, context, 3)
-    elif query.data == '2_slippage':
-        await handle_slippage(update, context, 2)
-    elif query.data == '1_slippage':
-        await handle_slippage(update, context, 1)
-    elif query.data == 'x_amount':
+    if not await callback_router.dispatch(update, context):
+        await query.message.reply_text(f"You selected {query.data}")
+
+
+def parse_callback_number(value):
+    """Keep whole numbers as int so replies read "25%" rather than "25.0%"."""
+    return int(value) if value.isdigit() else float(value)
+
+
+async def handle_amount_callback(update: Update,
+                                 context: ContextTypes.DEFAULT_TYPE,
+                                 kind,
+                                 value=None) -> None:
+    """Handles ``amt:pct:<n>``, ``amt:eth:<n>`` and ``amt:x``."""
+    query = update.callback_query
+    if kind == 'pct':
+        await handle_amount_to_trade(update, context, query,
+                                     parse_callback_number(value))
+    elif kind == 'eth':
+        await handle_amount_to_trade_number(update, context, query,
+                                            parse_callback_number(value))
+    elif kind == 'x':
         await handle_x_amount(update, context, query)
-    elif query.data == 'x_slippage':
-        await handle_x_slippage(update, context)
-    elif query.data == 'deposit_eth':
-        await handle_button_deposit_eth(update, context)
-    elif query.data == 'withdraw_eth':
-        await handle_button_withdraw_eth(update, context)
-    elif query.data == 'export_key':
-        await handle_button_export_key(update, context)
-    elif query.data == 'pin_message':
-        await handle_button_pin_message(query, context)
-    elif query.data == 'buy':
-        await handle_button_buy(query, context)
-    elif query.data == 'sell':
-        await handle_button_sell(query, context)
-    elif query.data == 'trade_yes':
-        await handle_trade_confirmation(update, context, query)
-    elif query.data == 'trade_no':
-        await handle_trade_no(update, query)
-    elif query.data == 'my_position':
-        await handle_my_position(update, context)
-    elif query.data == 'trade_token_buy':
-        await handle_trade_token_buy(update, context)
-    elif query.data == 'trade_token_sell':
-        await handle_trade_token_sell(update, context)
-    elif query.data == 'trade_token_amount_click':
-        await handle_trade_amount_click(update, context, query)
 
+
+async def handle_slippage_callback(update: Update,
+                                   context: ContextTypes.DEFAULT_TYPE,
+                                   value) -> None:
+    """Handles ``slip:<n>`` and ``slip:x``."""
+    if value == 'x':
+        await handle_x_slippage(update, context)
     else:
-        await query.message.reply_text(f"You selected {query.data}")
+        await handle_slippage(update, context, parse_callback_number(value))
+
+
+async def handle_positions_callback(update: Update,
+                                    context: ContextTypes.DEFAULT_TYPE,
+                                    action, page) -> None:
+    """Handles ``pos:page:<n>``."""
+    if action == 'page':
+        await handle_positions_page(update, context, int(page))
+
+
+def register_callback_routes(router):
+    """Route table for inline keyboard callback data, see ``button``."""
+    router.register('check_balance', handle_button_check_balance)
+    router.register('referral', handle_button_referral)
+    router.register('trade', handle_button_trade)
+    router.register('deposit_eth', handle_button_deposit_eth)
+    router.register('withdraw_eth', handle_button_withdraw_eth)
+    router.register('export_key', handle_button_export_key)
+    router.register(
+        'pin_message', lambda update, context: handle_button_pin_message(
+            update.callback_query, context))
+    router.register(
+        'buy', lambda update, context: handle_button_buy(
+            update.callback_query, context))
+    router.register(
+        'sell', lambda update, context: handle_button_sell(
+            update.callback_query, context))
+    router.register(
+        'trade_yes', lambda update, context: handle_trade_confirmation(
+            update, context, update.callback_query))
+    router.register(
+        'trade_no',
+        lambda update, context: handle_trade_no(update, update.callback_query))
+    router.register('my_position', handle_my_position)
+    router.register('trade_token_buy', handle_trade_token_buy)
+    router.register('trade_token_sell', handle_trade_token_sell)
+    router.register(
+        'trade_token_amount_click',
+        lambda update, context: handle_trade_amount_click(
+            update, context, update.callback_query))
+    router.register('amt', handle_amount_callback)
+    router.register('slip', handle_slippage_callback)
+    router.register('pos', handle_positions_callback)
+
+    # Keyboards sent before the namespaced format still carry the old data
+    for percentage in AMOUNT_PERCENT_PRESETS:
+        router.alias(f'{percentage}_amount', f'amt:pct:{percentage}')
+    for amount in AMOUNT_ETH_PRESETS:
+        router.alias(f'{amount}_amount', f'amt:eth:{amount}')
+    for slippage in (1, 2, 3, 5):
+        router.alias(f'{slippage}_slippage', f'slip:{slippage}')
+    router.alias('x_amount', 'amt:x')
+    router.alias('x_slippage', 'slip:x')
 
 
 async def handle_slippage(update: Update, context: ContextTypes.DEFAULT_TYPE,
@@ -740,35 +968,41 @@ async def handle_slippage(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 async def handle_x_slippage(update: Update,
                             context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Ask user to enter slippage value and store it."""
+    """Ask user to enter slippage value; the reply is handled by handling_x_slippage."""
     message = update.callback_query.message if update.callback_query else update.message
 
     if not message:
         return
 
     try:
-        # Prompt the user to enter the slippage value
         await message.reply_text("Please enter the slippage value:",
                                  reply_markup=ForceReply())
-
-        # Replace the erroneous wait_for with the event loop listening for a message
-        user_response = await context.update_queue.get()
-        try:
-            slippage = (user_response.message.text.strip())
-        except ValueError:
-            await message.reply_text(
-                'Please enter a valid number for slippage.')
-            return
-        context.user_data['slippage_for_trade'] = slippage
-        print(f'Slippage manually set: {slippage}')
-
-        # Confirm the slippage has been set to the user
-        await message.reply_text(f'Slippage set: {slippage}',
-                                 parse_mode="Markdown")
+        expect_input(context, ConversationState.TRADE_X_SLIPPAGE)
     except Exception as e:
         print(f"An error occurred while handling slippage: {str(e)}")
 
 
+async def handling_x_slippage(update: Update,
+                              context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Store the slippage value entered by the user."""
+    slippage = update.message.text.strip()
+    try:
+        if float(slippage) <= 0:
+            raise ValueError("Slippage must be positive")
+    except ValueError:
+        await update.message.reply_text(
+            'Please enter a valid number for slippage.')
+        return
+
+    conversation_for(context.user_data).reset()
+    context.user_data['slippage_for_trade'] = slippage
+    print(f'Slippage manually set: {slippage}')
+
+    # Confirm the slippage has been set to the user
+    await update.message.reply_text(f'Slippage set: {slippage}',
+                                    parse_mode="Markdown")
+
+
 async def handle_x_amount(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -786,7 +1020,7 @@ async def handle_x_amount(
             "Please enter the amount you wish to trade:",
             reply_markup=ForceReply())
 
-        context.user_data['awaiting_x_amount'] = True
+        expect_input(context, ConversationState.TRADE_X_AMOUNT)
 
     except Exception as e:
         print(f"An error occurred while handling amount: {str(e)}")
@@ -795,7 +1029,7 @@ async def handle_x_amount(
 async def handling_x_amount(update: Update,
                             context: ContextTypes.DEFAULT_TYPE) -> None:
     """Ask user to enter slippage value and store it."""
-    context.user_data['awaiting_x_amount'] = False
+    conversation_for(context.user_data).reset()
 
     try:
         text = update.message.text.strip()
@@ -817,7 +1051,7 @@ async def handle_amount_to_trade(update: Update,
                                  context: ContextTypes.DEFAULT_TYPE,
                                  query: CallbackQuery, percentage) -> None:
     """Handle new handle_amount_to_trade"""
-    context.user_data['awaiting_trade_amount'] = True
+    expect_input(context, ConversationState.TRADE_AMOUNT)
     message = update.callback_query.message if update.callback_query else update.message
 
     if not message:
@@ -825,11 +1059,6 @@ async def handle_amount_to_trade(update: Update,
 
     try:
         print(percentage)
-        w3 = Web3(
-            Web3.HTTPProvider(
-                'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-            ))
-
         sell_token = Web3.to_checksum_address(
             context.user_data['trade_sell_token'])
         buy_token = Web3.to_checksum_address(
@@ -838,17 +1067,16 @@ async def handle_amount_to_trade(update: Update,
         wallet = await get_or_create_address(update)
         owner_address = wallet.address_id
         if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            balance_wei = w3.eth.get_balance(
-                Web3.to_checksum_address(
-                    owner_address))  # Use the owner's address for ETH balance
-            balance = w3.from_wei(balance_wei, 'ether')
+            balance_wei = await rpc_pool.call(
+                lambda w3: w3.eth.get_balance(
+                    Web3.to_checksum_address(owner_address))
+            )  # Use the owner's address for ETH balance
+            balance = Web3.from_wei(balance_wei, 'ether')
         else:
-            balance = Decimal(wallet.balance(sell_token))
+            balance = Decimal(await cdp_executor.run(
+                update.effective_user.id, wallet.balance, sell_token))
         print(f"🚀 ~ handle_amount_to_trade ~ balance: {balance}", percentage)
-        if percentage == 100:
-            balance_percentage = (balance)
-        else:
-            balance_percentage = ((percentage / 100) * float(balance))
+        balance_percentage = preset_percentage_amount(balance, percentage)
         print(balance_percentage)
         context.user_data['amount_to_trade'] = balance_percentage
         # if query.message:
@@ -873,7 +1101,7 @@ async def handle_amount_to_trade_number(update: Update,
                                         query: CallbackQuery,
                                         amount_to_trade: float) -> None:
     """Handle new handle_amount_to_trade"""
-    context.user_data['awaiting_trade_amount'] = True
+    expect_input(context, ConversationState.TRADE_AMOUNT)
     message = update.callback_query.message if update.callback_query else update.message
 
     if not message:
@@ -881,11 +1109,6 @@ async def handle_amount_to_trade_number(update: Update,
 
     try:
 
-        w3 = Web3(
-            Web3.HTTPProvider(
-                'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-            ))
-
         sell_token = Web3.to_checksum_address(
             context.user_data['trade_sell_token'])
         buy_token = Web3.to_checksum_address(
@@ -894,11 +1117,13 @@ async def handle_amount_to_trade_number(update: Update,
         wallet = await get_or_create_address(update)
         owner_address = wallet.address_id
         if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            balance_wei = w3.eth.get_balance(
-                Web3.to_checksum_address(owner_address))
-            balance = w3.from_wei(balance_wei, 'ether')
+            balance_wei = await rpc_pool.call(
+                lambda w3: w3.eth.get_balance(
+                    Web3.to_checksum_address(owner_address)))
+            balance = Web3.from_wei(balance_wei, 'ether')
         else:
-            balance = Decimal(wallet.balance(sell_token))
+            balance = Decimal(await cdp_executor.run(
+                update.effective_user.id, wallet.balance, sell_token))
 
         if amount_to_trade > balance:
             await message.reply_text("Not enough balance to execute trade.")
@@ -926,7 +1151,8 @@ async def handle_withdraw_amount(update: Update,
             raise ValueError("Invalid decimal format")
         amount = Decimal(text)
         wallet = await get_or_create_address(update)
-        balance = Decimal(wallet.balance('eth'))
+        balance = Decimal(await cdp_executor.run(update.effective_user.id,
+                                                 wallet.balance, 'eth'))
 
         if amount <= 0:
             await update.message.reply_text("Please enter a positive amount.")
@@ -935,9 +1161,7 @@ async def handle_withdraw_amount(update: Update,
                 f"Insufficient balance. Your current ETH balance is {balance}."
             )
         else:
-            context.user_data['withdraw_amount'] = amount
-            context.user_data['awaiting_withdraw_address'] = True
-            context.user_data['awaiting_withdraw_amount'] = False
+            expect_input(context, ConversationState.WITHDRAW_ADDRESS, amount)
             await update.message.reply_text(
                 "Please enter the Ethereum address to withdraw to:",
                 reply_markup=ForceReply())
@@ -946,33 +1170,82 @@ async def handle_withdraw_amount(update: Update,
             "Invalid amount. Please enter a valid number.")
 
 
+def cdp_transaction_hash(operation):
+    """Return the hash of a broadcast CDP transfer or trade, if known yet."""
+    tx_hash = getattr(operation, 'transaction_hash', None)
+    if tx_hash is None and getattr(operation, 'transaction', None) is not None:
+        tx_hash = operation.transaction.transaction_hash
+    return tx_hash
+
+
+def cdp_operation_settled(operation):
+    """Whether a CDP transfer or trade has reached a terminal state."""
+    if hasattr(operation, 'terminal_state'):
+        return operation.terminal_state
+    return operation.transaction.terminal_state
+
+
+async def wait_for_cdp_operation(operation):
+    """Poll a CDP transfer or trade until it lands and return its hash."""
+    # Each reload runs on its own executor key and no thread is held between
+    # polls, so the wait does not block the user's other CDP calls
+    executor_key = f"cdp_operation:{id(operation)}"
+    deadline = time.monotonic() + settlement_tracker.timeout
+    while not cdp_operation_settled(operation):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timed out waiting for the transaction to land")
+        await asyncio.sleep(settlement_tracker.interval)
+        await cdp_executor.run(executor_key, operation.reload)
+    if str(operation.status).lower() == 'failed':
+        raise RuntimeError("transaction failed onchain")
+    return cdp_transaction_hash(operation)
+
+
+async def track_cdp_operation(update: Update, operation, pending_message,
+                              success_text: str, failure_text: str) -> None:
+    """Hand a submitted CDP transfer or trade to the settlement tracker."""
+    # CDP picked the nonce for this transaction; resync before our next one
+    wallet = await get_or_create_address(update)
+    nonce_manager.reset(wallet.address_id)
+    tx_hash = cdp_transaction_hash(operation)
+    if tx_hash:
+        settlement_tracker.track(tx_hash, pending_message.chat_id,
+                                 pending_message.message_id, success_text,
+                                 failure_text)
+    else:
+        settlement_tracker.track_awaitable(wait_for_cdp_operation(operation),
+                                           pending_message.chat_id,
+                                           pending_message.message_id,
+                                           success_text, failure_text)
+
+
 async def handle_withdraw_address(update: Update,
                                   context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the withdrawal address input."""
     address = update.message.text
     if is_valid_eth_address(address):
-        amount = context.user_data['withdraw_amount']
+        amount = conversation_for(context.user_data).payload
         wallet = await get_or_create_address(update)
 
         waiting_message = await update.message.reply_text(
-            "Waiting for withdrawal to complete...")
+            "Withdrawal pending, waiting for confirmation...")
 
         try:
-            transfer = wallet.transfer(amount, 'eth', address).wait()
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=waiting_message.message_id)
-            await update.message.reply_text(
-                f"Withdrawal complete! Transaction link: {transfer.transaction_link}"
-            )
+            transfer = await cdp_executor.run(update.effective_user.id,
+                                              wallet.transfer, amount, 'eth',
+                                              address)
+            await track_cdp_operation(
+                update, transfer, waiting_message,
+                "Withdrawal complete! Transaction link: {link}",
+                "Withdrawal failed: {error} {link}")
         except Exception as e:
             await context.bot.delete_message(
                 chat_id=update.effective_chat.id,
                 message_id=waiting_message.message_id)
             await update.message.reply_text(f"Withdrawal failed: {str(e)}")
 
-        context.user_data['awaiting_withdraw_address'] = False
-        context.user_data.pop('withdraw_amount', None)
+        conversation_for(context.user_data).reset()
+        wallet_sessions.invalidate(str(update.effective_user.id))
     else:
         await update.message.reply_text(
             "Invalid Ethereum address. Please enter a valid address.")
@@ -987,7 +1260,8 @@ async def handle_buy_amount(update: Update,
             raise ValueError("Invalid decimal format")
         amount = Decimal(text)
         wallet = await get_or_create_address(update)
-        balance = Decimal(wallet.balance('eth'))
+        balance = Decimal(await cdp_executor.run(update.effective_user.id,
+                                                 wallet.balance, 'eth'))
 
         if amount <= 0:
             await update.message.reply_text("Please enter a positive amount.")
@@ -996,9 +1270,7 @@ async def handle_buy_amount(update: Update,
                 f"Insufficient balance. Your current ETH balance is {balance}."
             )
         else:
-            context.user_data['buy_amount'] = amount
-            context.user_data['awaiting_buy_asset'] = True
-            context.user_data['awaiting_buy_amount'] = False
+            expect_input(context, ConversationState.BUY_ASSET, amount)
             await update.message.reply_text(
                 "Please enter the asset you'd like to buy (contract address):",
                 reply_markup=ForceReply())
@@ -1011,34 +1283,32 @@ async def handle_buy_asset(update: Update,
                            context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the buy asset input."""
     asset = update.message.text
-    amount = context.user_data['buy_amount']
+    amount = conversation_for(context.user_data).payload
     wallet = await get_or_create_address(update)
 
-    waiting_message = await update.message.reply_text("Executing buy...")
+    waiting_message = await update.message.reply_text(
+        "Buy pending, waiting for confirmation...")
 
     try:
-        trade = wallet.trade(amount, 'eth', asset).wait()
-        await context.bot.delete_message(chat_id=update.effective_chat.id,
-                                         message_id=waiting_message.message_id)
-        await update.message.reply_text(
-            f"Buy successfully completed! Transaction link: {trade.transaction.transaction_link}"
-        )
+        trade = await cdp_executor.run(update.effective_user.id, wallet.trade,
+                                       amount, 'eth', asset)
+        await track_cdp_operation(
+            update, trade, waiting_message,
+            "Buy successfully completed! Transaction link: {link}",
+            "Buy failed: {error} {link}")
     except Exception as e:
         await context.bot.delete_message(chat_id=update.effective_chat.id,
                                          message_id=waiting_message.message_id)
         await update.message.reply_text(f"Buy failed: {str(e)}")
 
-    context.user_data['awaiting_buy_asset'] = False
-    context.user_data.pop('buy_amount', None)
+    conversation_for(context.user_data).reset()
 
 
 async def handle_sell_asset(update: Update,
                             context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the sell asset input."""
     asset = update.message.text
-    context.user_data['sell_asset'] = asset
-    context.user_data['awaiting_sell_asset'] = False
-    context.user_data['awaiting_sell_amount'] = True
+    expect_input(context, ConversationState.SELL_AMOUNT, asset)
     await update.message.reply_text(
         f"How much {asset} would you like to sell?", reply_markup=ForceReply())
 
@@ -1051,10 +1321,11 @@ async def handle_sell_amount(update: Update,
         if not text or not text.replace('.', '', 1).isdigit():
             raise ValueError("Invalid decimal format")
         amount = Decimal(text)
-        asset = context.user_data['sell_asset']
+        asset = conversation_for(context.user_data).payload
         print(asset)
         wallet = await get_or_create_address(update)
-        balance = Decimal(wallet.balance(asset))
+        balance = Decimal(await cdp_executor.run(update.effective_user.id,
+                                                 wallet.balance, asset))
 
         if amount <= 0:
             await update.message.reply_text("Please enter a positive amount.")
@@ -1064,24 +1335,23 @@ async def handle_sell_amount(update: Update,
             )
         else:
             waiting_message = await update.message.reply_text(
-                "Executing sell...")
+                "Sell pending, waiting for confirmation...")
 
             try:
-                trade = wallet.trade(amount, asset, 'eth').wait()
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=waiting_message.message_id)
-                await update.message.reply_text(
-                    f"Sell successfully completed! Transaction link: {trade.transaction.transaction_link}"
-                )
+                trade = await cdp_executor.run(update.effective_user.id,
+                                               wallet.trade, amount, asset,
+                                               'eth')
+                await track_cdp_operation(
+                    update, trade, waiting_message,
+                    "Sell successfully completed! Transaction link: {link}",
+                    "Sell failed: {error} {link}")
             except Exception as e:
                 await context.bot.delete_message(
                     chat_id=update.effective_chat.id,
                     message_id=waiting_message.message_id)
                 await update.message.reply_text(f"Sell failed: {str(e)}")
 
-            context.user_data['awaiting_sell_amount'] = False
-            context.user_data.pop('sell_asset', None)
+            conversation_for(context.user_data).reset()
     except ValueError:
         await update.message.reply_text(
             "Invalid amount. Please enter a valid number.")
@@ -1097,7 +1367,7 @@ async def handle_trade_token_buy(update: Update,
     buy_token = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
 
     context.user_data['trade_buy_token'] = buy_token
-    context.user_data['awaiting_trade_sell_token_auto'] = True
+    expect_input(context, ConversationState.TRADE_SELL_TOKEN_AUTO)
     await message.reply_text(
         "Enter the token you want to sell (contract address):",
         reply_markup=ForceReply())
@@ -1112,8 +1382,7 @@ async def handle_trade_token_sell(update: Update,
         return
     sell_token = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
     context.user_data['trade_sell_token'] = sell_token
-    context.user_data['awaiting_trade_sell_token'] = False
-    context.user_data['awaiting_trade_buy_token'] = True
+    expect_input(context, ConversationState.TRADE_BUY_TOKEN)
     await message.reply_text(
         "Enter the token you want to buy (contract address):",
         reply_markup=ForceReply())
@@ -1132,7 +1401,7 @@ async def handle_button_trade(update: Update,
         await update.message.reply_text(
             "Enter the token you want to sell (contract address):",
             reply_markup=ForceReply())
-    context.user_data['awaiting_trade_sell_token'] = True
+    expect_input(context, ConversationState.TRADE_SELL_TOKEN)
 
 
 async def handle_trade_sell_token(update: Update,
@@ -1144,8 +1413,7 @@ async def handle_trade_sell_token(update: Update,
         await update.message.reply_text("Please provide a valid address.")
         return
     context.user_data['trade_sell_token'] = sell_token
-    context.user_data['awaiting_trade_sell_token'] = False
-    context.user_data['awaiting_trade_buy_token'] = True
+    expect_input(context, ConversationState.TRADE_BUY_TOKEN)
     await update.message.reply_text(
         "Enter the token you want to buy (contract address):",
         reply_markup=ForceReply())
@@ -1159,14 +1427,8 @@ async def handle_trade_buy_token(update: Update,
         await update.message.reply_text("Please provide a valid address.")
         return
     context.user_data['trade_buy_token'] = buy_token
-    context.user_data['awaiting_trade_buy_token'] = False
+    conversation_for(context.user_data).reset()
     context.user_data['slippage_for_trade'] = "5"
-    # Create a Web3 instance using HTTPProvider
-    w3 = Web3(
-        Web3.HTTPProvider(
-            'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-        ))
-
     # Convert the sell token from context to a checksum address
     sell_token = Web3.to_checksum_address(
         context.user_data['trade_sell_token'])
@@ -1182,16 +1444,23 @@ async def handle_trade_buy_token(update: Update,
 
     # Fetch and compute balance depending on the token type
     if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-        balance_wei = w3.eth.get_balance(
-            Web3.to_checksum_address(
-                owner_address))  # Use the owner's address for ETH balance
-        balance = w3.from_wei(balance_wei, 'ether')
+        balance_wei = await rpc_pool.call(
+            lambda w3: w3.eth.get_balance(Web3.to_checksum_address(owner_address))
+        )  # Use the owner's address for ETH balance
+        balance = Web3.from_wei(balance_wei, 'ether')
 
 
 # Convert balance from wei to ether
     else:
-        balance = Decimal(wallet.balance(sell_token))  # Fetch token balance
+        balance = Decimal(await cdp_executor.run(
+            update.effective_user.id, wallet.balance,
+            sell_token))  # Fetch token balance
     print(f"Balance: {balance}")
+    if QUOTE_PREFETCH:
+        context.application.create_task(
+            quote_engine.prefetch(owner_address, sell_token, buy_token,
+                                  preset_trade_amounts(sell_token, balance),
+                                  context.user_data['slippage_for_trade']))
 
     chain = 8453
     tokens = [
@@ -1202,8 +1471,9 @@ async def handle_trade_buy_token(update: Update,
         if buy_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
         else f"{Web3.to_checksum_address(buy_token)}:{chain}"
     ]
+    price_feed.record_trade(tokens)
 
-    price_data = fetch_price_from_codex(tokens, chain)
+    price_data = await fetch_price_from_codex(tokens, chain)
 
     sell_token_tocheck = "0x4200000000000000000000000000000000000006" if sell_token.lower(
     ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
@@ -1249,39 +1519,39 @@ async def handle_trade_buy_token(update: Update,
             [InlineKeyboardButton("↩️ Back", callback_data="trade_no")],
             [
                 InlineKeyboardButton(f"25% {sell_symbol}",
-                                     callback_data="25_amount"),
+                                     callback_data="amt:pct:25"),
                 InlineKeyboardButton(f"50% {sell_symbol}",
-                                     callback_data="50_amount")
+                                     callback_data="amt:pct:50")
             ],
             [
                 InlineKeyboardButton(f"75% {sell_symbol}",
-                                     callback_data="75_amount"),
+                                     callback_data="amt:pct:75"),
                 InlineKeyboardButton(f"100% {sell_symbol}",
-                                     callback_data="100_amount"),
+                                     callback_data="amt:pct:100"),
             ],
             [
                 InlineKeyboardButton(f"0.05 {sell_symbol}",
-                                     callback_data="0.05_amount"),
+                                     callback_data="amt:eth:0.05"),
                 InlineKeyboardButton(f"0.1 {sell_symbol}",
-                                     callback_data="0.1_amount")
+                                     callback_data="amt:eth:0.1")
             ],
             [
                 InlineKeyboardButton(f"0.3 {sell_symbol}",
-                                     callback_data="0.3_amount"),
+                                     callback_data="amt:eth:0.3"),
                 InlineKeyboardButton(f"0.5 {sell_symbol}",
-                                     callback_data="0.5_amount"),
+                                     callback_data="amt:eth:0.5"),
             ],
             [
                 InlineKeyboardButton("X Slippage ✏️",
-                                     callback_data="x_slippage"),
+                                     callback_data="slip:x"),
                 InlineKeyboardButton(f"Amount X {sell_symbol} ✏️",
-                                     callback_data="x_amount"),
+                                     callback_data="amt:x"),
             ],
             [
                 InlineKeyboardButton("✅ 5% Slippage",
-                                     callback_data="5_slippage"),
+                                     callback_data="slip:5"),
                 InlineKeyboardButton("2% Slippage",
-                                     callback_data="2_slippage"),
+                                     callback_data="slip:2"),
             ],
         ]
     else:
@@ -1289,27 +1559,27 @@ async def handle_trade_buy_token(update: Update,
             [InlineKeyboardButton("↩️ Back", callback_data="trade_no")],
             [
                 InlineKeyboardButton(f"25% {sell_symbol}",
-                                     callback_data="25_amount"),
+                                     callback_data="amt:pct:25"),
                 InlineKeyboardButton(f"50% {sell_symbol}",
-                                     callback_data="50_amount")
+                                     callback_data="amt:pct:50")
             ],
             [
                 InlineKeyboardButton(f"75% {sell_symbol}",
-                                     callback_data="75_amount"),
+                                     callback_data="amt:pct:75"),
                 InlineKeyboardButton(f"100% {sell_symbol}",
-                                     callback_data="100_amount"),
+                                     callback_data="amt:pct:100"),
             ],
             [
                 InlineKeyboardButton("X Slippage ✏️",
-                                     callback_data="x_slippage"),
+                                     callback_data="slip:x"),
                 InlineKeyboardButton(f"Amount X {sell_symbol} ✏️",
-                                     callback_data="x_amount"),
+                                     callback_data="amt:x"),
             ],
             [
                 InlineKeyboardButton("✅ 5% Slippage",
-                                     callback_data="5_slippage"),
+                                     callback_data="slip:5"),
                 InlineKeyboardButton("2% Slippage",
-                                     callback_data="2_slippage"),
+                                     callback_data="slip:2"),
             ],
         ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1336,14 +1606,8 @@ async def handle_trade_sell_token_auto(
         await update.message.reply_text("Please provide a valid address.")
         return
     context.user_data['trade_sell_token'] = sell_token
-    context.user_data['awaiting_trade_sell_token_auto'] = False
+    conversation_for(context.user_data).reset()
     context.user_data['slippage_for_trade'] = "5"
-    # Create a Web3 instance using HTTPProvider
-    w3 = Web3(
-        Web3.HTTPProvider(
-            'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-        ))
-
     # Convert the sell token from context to a checksum address
     buy_token_new = Web3.to_checksum_address(
         context.user_data['trade_buy_token'])
@@ -1360,15 +1624,22 @@ async def handle_trade_sell_token_auto(
 
     # Fetch and compute balance depending on the token type
     if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-        balance_wei = w3.eth.get_balance(
-            Web3.to_checksum_address(
-                owner_address))  # Use the owner's address for ETH balance
-        balance = w3.from_wei(balance_wei, 'ether')
+        balance_wei = await rpc_pool.call(
+            lambda w3: w3.eth.get_balance(Web3.to_checksum_address(owner_address))
+        )  # Use the owner's address for ETH balance
+        balance = Web3.from_wei(balance_wei, 'ether')
 
     # Convert balance from wei to ether
     else:
-        balance = Decimal(wallet.balance(sell_token))  # Fetch token balance
+        balance = Decimal(await cdp_executor.run(
+            update.effective_user.id, wallet.balance,
+            sell_token))  # Fetch token balance
     print(f"Balance: {balance}")
+    if QUOTE_PREFETCH:
+        context.application.create_task(
+            quote_engine.prefetch(owner_address, sell_token, buy_token,
+                                  preset_trade_amounts(sell_token, balance),
+                                  context.user_data['slippage_for_trade']))
 
     chain = 8453
     tokens = [
@@ -1379,8 +1650,9 @@ async def handle_trade_sell_token_auto(
         if buy_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
         else f"{Web3.to_checksum_address(buy_token)}:{chain}"
     ]
+    price_feed.record_trade(tokens)
 
-    price_data = fetch_price_from_codex(tokens, chain)
+    price_data = await fetch_price_from_codex(tokens, chain)
 
     sell_token_tocheck = "0x4200000000000000000000000000000000000006" if sell_token.lower(
     ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
@@ -1426,39 +1698,39 @@ async def handle_trade_sell_token_auto(
             [InlineKeyboardButton("↩️ Back", callback_data="trade_no")],
             [
                 InlineKeyboardButton(f"25% {sell_symbol}",
-                                     callback_data="25_amount"),
+                                     callback_data="amt:pct:25"),
                 InlineKeyboardButton(f"50% {sell_symbol}",
-                                     callback_data="50_amount")
+                                     callback_data="amt:pct:50")
             ],
             [
                 InlineKeyboardButton(f"75% {sell_symbol}",
-                                     callback_data="75_amount"),
+                                     callback_data="amt:pct:75"),
                 InlineKeyboardButton(f"100% {sell_symbol}",
-                                     callback_data="100_amount"),
+                                     callback_data="amt:pct:100"),
             ],
             [
                 InlineKeyboardButton(f"0.05 {sell_symbol}",
-                                     callback_data="0.05_amount"),
+                                     callback_data="amt:eth:0.05"),
                 InlineKeyboardButton(f"0.1 {sell_symbol}",
-                                     callback_data="0.1_amount")
+                                     callback_data="amt:eth:0.1")
             ],
             [
                 InlineKeyboardButton(f"0.3 {sell_symbol}",
-                                     callback_data="0.3_amount"),
+                                     callback_data="amt:eth:0.3"),
                 InlineKeyboardButton(f"0.5 {sell_symbol}",
-                                     callback_data="0.5_amount"),
+                                     callback_data="amt:eth:0.5"),
             ],
             [
                 InlineKeyboardButton("X Slippage ✏️",
-                                     callback_data="x_slippage"),
+                                     callback_data="slip:x"),
                 InlineKeyboardButton(f"Amount X {sell_symbol} ✏️",
-                                     callback_data="x_amount"),
+                                     callback_data="amt:x"),
             ],
             [
                 InlineKeyboardButton("✅ 5% Slippage",
-                                     callback_data="5_slippage"),
+                                     callback_data="slip:5"),
                 InlineKeyboardButton("2% Slippage",
-                                     callback_data="2_slippage"),
+                                     callback_data="slip:2"),
             ],
         ]
     else:
@@ -1466,27 +1738,27 @@ async def handle_trade_sell_token_auto(
             [InlineKeyboardButton("↩️ Back", callback_data="trade_no")],
             [
                 InlineKeyboardButton(f"25% {sell_symbol}",
-                                     callback_data="25_amount"),
+                                     callback_data="amt:pct:25"),
                 InlineKeyboardButton(f"50% {sell_symbol}",
-                                     callback_data="50_amount")
+                                     callback_data="amt:pct:50")
             ],
             [
                 InlineKeyboardButton(f"75% {sell_symbol}",
-                                     callback_data="75_amount"),
+                                     callback_data="amt:pct:75"),
                 InlineKeyboardButton(f"100% {sell_symbol}",
-                                     callback_data="100_amount"),
+                                     callback_data="amt:pct:100"),
             ],
             [
                 InlineKeyboardButton("X Slippage ✏️",
-                                     callback_data="x_slippage"),
+                                     callback_data="slip:x"),
                 InlineKeyboardButton(f"Amount X {sell_symbol} ✏️",
-                                     callback_data="x_amount"),
+                                     callback_data="amt:x"),
             ],
             [
                 InlineKeyboardButton("✅ 5% Slippage",
-                                     callback_data="5_slippage"),
+                                     callback_data="slip:5"),
                 InlineKeyboardButton("2% Slippage",
-                                     callback_data="2_slippage"),
+                                     callback_data="slip:2"),
             ],
         ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1497,296 +1769,163 @@ async def handle_trade_sell_token_auto(
                              reply_markup=reply_markup)
 
 
-async def handle_trade_amount(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-) -> None:
-    """Handle the trade amount input."""
+def preset_percentage_amount(balance, percentage):
+    """Amount to trade for a percent-of-balance button."""
+    if percentage == 100:
+        return balance
+    return (percentage / 100) * float(balance)
+
+
+def preset_trade_amounts(sell_token, balance):
+    """Amounts behind the trade screen's amount buttons, in sell-token units."""
+    amounts = [
+        preset_percentage_amount(balance, percentage)
+        for percentage in AMOUNT_PERCENT_PRESETS
+    ]
+    if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
+        amounts += [
+            parse_callback_number(amount) for amount in AMOUNT_ETH_PRESETS
+            if Decimal(amount) <= balance
+        ]
+    return amounts
+
+
+def format_change(change):
+    symbol = "+" if float(change) > 0 else "-"
+    return f"{symbol}{abs(round(float(change), 6)):.6f}%"
+
+
+def render_quote(result):
+    """Confirmation message for a quoted trade."""
+    sell_market = result.sell_market
+    buy_market = result.buy_market
+    sell_symbol = sell_market['token']['symbol']
+    buy_symbol = buy_market['token']['symbol']
+    symbol = "+" if result.price_impact > 0 else "-"
+    formatted_price_impact = f"{symbol}{abs(result.price_impact)}%"
+    return (
+        f"Details ${sell_symbol} — ${buy_symbol} 📈 · 🔍\n"
+        f"Token address: {sell_market['token']['address']}\n"
+        f"Balance: {result.balance} ({sell_symbol})\n"
+        f"Price: ${format_number(sell_market['priceUSD'])} — LIQ: ${format_number(sell_market['liquidity'])} — MC: ${format_number(sell_market['marketCap'])}\n\n"
+        f"1h: {format_change(sell_market['change1'])} — 24h: {format_change(sell_market['change24'])}\n\n"
+        f"Token address: {buy_market['token']['address']}\n"
+        f"Price: ${format_number(buy_market['priceUSD'])} — LIQ: ${format_number(buy_market['liquidity'])} — MC: ${format_number(buy_market['marketCap'])}\n\n"
+        f"1h: {format_change(buy_market['change1'])} — 24h: {format_change(buy_market['change24'])}\n\n"
+        # f"Renounced ✅\n\n"
+        f"🟢 Fetched Quote (Velvet), best of {len(result.ranked_routes)} routes\n"
+        f"(${round(result.sell_value_usd, 2)}) ↔️ "
+        f" (${round(result.buy_value_usd, 2)})\n"
+        f"Network fee: ~${round(result.gas_cost_usd, 2)} · Slippage: {result.slippage}%\n\n"
+        f"Price Impact: {formatted_price_impact}")
+
+
+async def quote_trade_amount(update: Update,
+                             context: ContextTypes.DEFAULT_TYPE,
+                             message) -> None:
+    """Quote ``amount_to_trade`` for the selected pair and ask for confirmation."""
     try:
-        print(context.user_data['slippage_for_trade'],
-              "context.user_data['slippage_for_trade'] ")
-        w3 = Web3(
-            Web3.HTTPProvider(
-                'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-            ))
         amount = (context.user_data['amount_to_trade'])
         print(amount, "amount")
         sell_token = Web3.to_checksum_address(
             context.user_data['trade_sell_token'])
         buy_token = Web3.to_checksum_address(
             context.user_data['trade_buy_token'])
-
-        wallet = await get_or_create_address(update)
-        owner_address = wallet.address_id
-        if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            balance = w3.eth.get_balance(
-                Web3.to_checksum_address(
-                    owner_address))  # Fetch ETH balance# Fetch ETH balance
-        else:
-            balance = Decimal(wallet.balance(sell_token))
-        print(balance)
-
         slippage = context.user_data[
             'slippage_for_trade'] if context.user_data.get(
                 'slippage_for_trade') else "5"
 
+        wallet = await get_or_create_address(update)
+        try:
+            result = await quote_engine.prepare(wallet.address_id, sell_token,
+                                                buy_token, amount)
+        except QuoteError as e:
+            await message.reply_text(str(e))
+            return
+
         if (amount) <= 0:
-            await update.message.reply_text("Please enter a positive amount.")
-        elif amount > balance:
-            await update.message.reply_text(
-                f"Insufficient balance. Your current {sell_token} balance is {balance}."
+            await message.reply_text("Please enter a positive amount.")
+        elif amount > result.balance:
+            await message.reply_text(
+                f"Insufficient balance. Your current {sell_token} balance is {result.balance}."
             )
         else:
-            chain = 8453
-            tokens = [
-                f"0x4200000000000000000000000000000000000006:{chain}"
-                if sell_token.lower()
-                == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else
-                f"{Web3.to_checksum_address(sell_token)}:{chain}",
-                f"0x4200000000000000000000000000000000000006:{chain}"
-                if buy_token.lower()
-                == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else
-                f"{Web3.to_checksum_address(buy_token)}:{chain}"
-            ]
-
-            price_data = fetch_price_from_codex(tokens, chain)
-
-            sell_token_tocheck = "0x4200000000000000000000000000000000000006" if sell_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
-
-            if price_data[0]['token']['address'].lower(
-            ) == sell_token_tocheck.lower():
-                sell_element = price_data[0]
-                buy_element = price_data[1]
-            else:
-                sell_element = price_data[1]
-                buy_element = price_data[0]
-
-            # Debugging
-            print(f"Sell Token Address: {sell_token_tocheck}")
-            print(f"Sell Element: {sell_element}")
-            print(f"Buy Element: {buy_element}")
-            print("handle_trade_amount")
-
-            # Extracting values for the sell token
-            sell_symbol = sell_element['token']['symbol']
-            sell_price = sell_element['priceUSD']
-            sell_liquidity = sell_element['liquidity']
-            sell_market_cap = sell_element['marketCap']
-            sell_change1 = sell_element['change1']
-            sell_change24 = sell_element['change24']
-
-            # Extracting values for the buy token
-            buy_symbol = buy_element['token']['symbol']
-            buy_price = buy_element['priceUSD']
-            buy_liquidity = buy_element['liquidity']
-            buy_market_cap = buy_element['marketCap']
-            buy_change1 = buy_element['change1']
-            buy_change24 = buy_element['change24']
-
-            # Print for verification
-            print(f"Sell Symbol: {sell_symbol}, Buy Symbol: {buy_symbol}")
-
-            print(
-                f"First Token - Price: {sell_price}, Liquidity: {sell_liquidity}, Market Cap: {sell_market_cap}"
-            )
-            print(
-                f"Second Token - Price: {buy_price}, Liquidity: {buy_liquidity}, Market Cap: {buy_market_cap}"
-            )
-
-            sell_token_address = Web3.to_checksum_address(sell_token)
-            print(sell_token_address)
-
-            erc20_contract = None
-            # Create contract instance
-            if sell_token_address.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                sell_token_decimals = 18  # Directly use token decimal 18
-            else:
-                erc20_contract = w3.eth.contract(address=sell_token_address,
-                                                 abi=ERC20_ABI)
-                # Call decimals function inside a try block
-                sell_token_decimals = erc20_contract.functions.decimals().call(
-                )
-            print(sell_token_decimals)
-            converted_amount = int(amount * (10**sell_token_decimals))
-            # API Call parameters
-            wallet = await get_or_create_address(update)
-            private_key = wallet.key.key.hex()
-            account = Account.from_key(private_key)
-            nonce = w3.eth.get_transaction_count(account.address)
             # Check if approval already given
-            if sell_token_address.lower(
-            ) != "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                current_allowance = erc20_contract.functions.allowance(
-                    owner_address,
-                    "0xfDAc2748713906ede00D023AA3E0Cc893828D30B").call()
-                if current_allowance >= converted_amount:
-                    await update.message.reply_text(
-                        "Approval already exists, no need for new approval.")
-                else:
-                    await update.message.reply_text(
-                        "Processing token approval…")
-                    approve_tx = erc20_contract.functions.approve(
-                        "0xfDAc2748713906ede00D023AA3E0Cc893828D30B",
-                        converted_amount
-                    ).build_transaction({
-                        'chainId':
-                        8453,  # Adjust as necessary (1 for Ethereum mainnet)
-                        'gas': 200000,  # Provide an adequate gas limit
-                        'gasPrice':
-                        w3.eth.gas_price,  # Fetch current gas price
-                        'nonce': nonce,
-                    })
-                    # Sign the transaction
-                    signed_approve_tx = w3.eth.account.sign_transaction(
-                        approve_tx, private_key)
-                    try:
-                        tx_hash = w3.eth.send_raw_transaction(
-                            signed_approve_tx.raw_transaction)
-                        await update.message.reply_text(
-                            f"Successfully approved! Transaction hash: {tx_hash.hex()}"
-                        )
-                    except Exception as e:
-                        await update.message.reply_text(
-                            f"Approval failed: {str(e)}")
-
-            sell_token_address_to_check = sell_token.lower(
-            ) if sell_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
-            buy_token_address_to_check = buy_token.lower() if buy_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else buy_token
-            await update.message.reply_text("Fetching the quote…")
-            print("one issue")
-            params = {
-                "slippage": str(slippage),
-                "amount": str(converted_amount
-                              ),  # The amount should be converted to string
-                "tokenIn": sell_token_address_to_check,
-                "tokenOut": buy_token_address_to_check,
-                "sender": owner_address,
-                "receiver": owner_address,
-                "chainId": 8453,
-                "skipSimulation": False,
-            }
-            # print(params)
-            post_url = 'https://metasolvertest.velvetdao.xyz/best-quotes'
-
-            async with httpx.AsyncClient() as client:
+            if result.needs_approval:
+                await message.reply_text("Processing token approval…")
                 try:
-                    response = await client.post(post_url, json=params)
-                    response.raise_for_status()
-                    # print(response.json())
-
+                    tx_hash = await quote_engine.approve(
+                        result, wallet.key.key.hex())
+                    await message.reply_text(
+                        f"Successfully approved! Transaction hash: {tx_hash.hex()}"
+                    )
                 except Exception as e:
-                    error_msg = f"Fail to fetch routes please retry {e}."
-                    print(error_msg)
-                    retry_keyboard = [[
-                        InlineKeyboardButton(
-                            "Retry", callback_data='trade_token_amount_click')
-                    ]]
-                    retry_reply_markup = InlineKeyboardMarkup(retry_keyboard)
-                    await update.message.reply_text(
-                        error_msg, reply_markup=retry_reply_markup)
-                    return
-
-                keyboard = [[
-                    InlineKeyboardButton("Yes", callback_data='trade_yes'),
-                    InlineKeyboardButton("No", callback_data='trade_no')
+                    quote_engine.forget_allowance(result.owner_address,
+                                                  result.sell_token)
+                    await message.reply_text(f"Approval failed: {str(e)}")
+            elif result.allowance is not None:
+                await message.reply_text(
+                    "Approval already exists, no need for new approval.")
+
+            await message.reply_text("Fetching the quote…")
+            try:
+                await quote_engine.quote(result, slippage)
+            except Exception as e:
+                error_msg = f"Fail to fetch routes please retry {e}."
+                print(error_msg)
+                retry_keyboard = [[
+                    InlineKeyboardButton(
+                        "Retry", callback_data='trade_token_amount_click')
                 ]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
-                # print(response.json())
-                meta_quote = response.json()
-                # print(meta_quote['quotes'][0])
-                context.user_data['meta_quote'] = meta_quote['quotes'][0]
-                context.user_data['buy_token_details'] = {
-                    'token_address': buy_token.lower(),
-                    'symbol': buy_symbol,
-                    'price': buy_price,
-                    'liquidity': buy_liquidity,
-                    'market_cap': buy_market_cap,
-                    'change1': buy_change1,
-                    'change24': buy_change24
-                }
-                best_quote = meta_quote['quotes'][0]['amountOut']
-                # print(best_quote)
-                try:
-                    # Convert address to checksum format
-                    buy_token_address = Web3.to_checksum_address(buy_token)
-                    # print(buy_token_address)
-                    # Create contract instance
-
-                    if buy_token_address.lower(
-                    ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                        buy_token_decimals = 18
-                    else:
-                        erc20_contract = w3.eth.contract(
-                            address=buy_token_address, abi=ERC20_ABI)
-                        # Call decimals function inside a try
-                        buy_token_decimals = erc20_contract.functions.decimals(
-                        ).call()
-                    normal_amount = Decimal(best_quote) / Decimal(
-                        10**buy_token_decimals)
-                    price_impact = round(
-                        ((Decimal(buy_price) * Decimal(normal_amount)) /
-                         (Decimal(sell_price) * Decimal(amount)) - 1) * 100, 2)
-                    symbol = "+" if price_impact > 0 else "-"
-                    formatted_price_impact = f"{symbol}{abs(price_impact)}%"
-                    if price_impact > 0:
-                        colored_price_impact = f"{formatted_price_impact}"
-                    else:
-                        colored_price_impact = f" {formatted_price_impact}"
-
-                    buy_change1_symbol = "+" if float(buy_change1) > 0 else "-"
-                    buy_change1_formatted_price_impact = f"{buy_change1_symbol}{abs(round(float(buy_change1),6)):.6f}%"
-
-                    buy_change24_symbol = "+" if float(
-                        buy_change24) > 0 else "-"
-
-                    buy_change24_formatted_price_impact = f"{buy_change1_symbol}{abs(round(float(buy_change24),6)):.6f}%"
-
-                    sell_change1_symbol = "+" if float(
-                        sell_change1) > 0 else "-"
-                    sell_change1_formatted_price_impact = f"{sell_change1_symbol}{abs(round(float(sell_change1),6)):.6f}%"
-
-                    sell_change24_symbol = "+" if float(
-                        sell_change24) > 0 else "-"
-
-                    sell_change24_formatted_price_impact = f"{sell_change1_symbol}{abs(round(float(sell_change24),6)):.6f}%"
-
-                    print(round(Decimal(sell_price) * Decimal(amount), 2),
-                          Decimal(amount), Decimal(sell_price))
-                    print(round(Decimal(buy_price) * Decimal(normal_amount)),
-                          2)
-                    await update.message.reply_text(
-                        f"Details ${sell_symbol} — ${buy_symbol} 📈 · 🔍\n"
-                        f"Token address: {sell_element['token']['address']}\n"
-                        f"Balance: {balance} ({sell_symbol})\n"
-                        f"Price: ${format_number(sell_price)} — LIQ: ${format_number(sell_liquidity)} — MC: ${format_number(sell_market_cap)}\n\n"
-                        f"1h: {sell_change1_formatted_price_impact} — 24h: {sell_change24_formatted_price_impact}\n\n"
-                        f"Token address: {buy_element['token']['address']}\n"
-                        f"Price: ${format_number(buy_price)} — LIQ: ${ format_number(buy_liquidity)} — MC: ${format_number(buy_market_cap)}\n\n"
-                        f"1h: {buy_change1_formatted_price_impact} — 24h: {buy_change24_formatted_price_impact}\n\n"
-                        # f"Renounced ✅\n\n"
-                        f"🟢 Fetched Quote (Velvet)\n"
-                        f"(${round(Decimal(sell_price) * Decimal(amount), 2)}) ↔️ "
-                        f" (${round(Decimal(buy_price) * Decimal(normal_amount), 2)})\n\n"
-                        f"Price Impact:{colored_price_impact}",
-                        reply_markup=reply_markup,
-                        parse_mode="HTML")
-                    # context.user_data['awaiting_trade_confirmation'] = True
-                except Exception as e:
-                    await update.message.reply_text(
-                        f"An error occurred when processing the token amount: {str(e)}"
-                    )
+                retry_reply_markup = InlineKeyboardMarkup(retry_keyboard)
+                await message.reply_text(error_msg,
+                                         reply_markup=retry_reply_markup)
+                return
+
+            keyboard = [[
+                InlineKeyboardButton("Yes", callback_data='trade_yes'),
+                InlineKeyboardButton("No", callback_data='trade_no')
+            ]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+
+            buy_market = result.buy_market
+            context.user_data['meta_quote'] = result.route
+            context.user_data['trade_spend'] = {
+                'token': result.sell_token,
+                'amount_in': result.amount_in
+            }
+            context.user_data['buy_token_details'] = {
+                'token_address': buy_token.lower(),
+                'symbol': buy_market['token']['symbol'],
+                'price': buy_market['priceUSD'],
+                'liquidity': buy_market['liquidity'],
+                'market_cap': buy_market['marketCap'],
+                'change1': buy_market['change1'],
+                'change24': buy_market['change24']
+            }
+            try:
+                await message.reply_text(render_quote(result),
+                                         reply_markup=reply_markup,
+                                         parse_mode="HTML")
+            except Exception as e:
+                await message.reply_text(
+                    f"An error occurred when processing the token amount: {str(e)}"
+                )
         # Clear trade data
-        context.user_data['awaiting_trade_amount'] = False
+        conversation_for(context.user_data).reset()
         context.user_data.pop('trade_sell_token', None)
         context.user_data.pop('trade_buy_token', None)
     except ValueError:
-        await update.message.reply_text(
-            "Invalid amount. Please enter a valid number.")
+        await message.reply_text("Invalid amount. Please enter a valid number."
+                                 )
+
+
+async def handle_trade_amount(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+) -> None:
+    """Handle the trade amount input."""
+    await quote_trade_amount(update, context, update.message)
 
 
 async def handle_trade_amount_click(
@@ -1799,285 +1938,7 @@ async def handle_trade_amount_click(
 
     if not message:
         return
-    try:
-        w3 = Web3(
-            Web3.HTTPProvider(
-                'https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base'
-            ))
-        amount = (context.user_data['amount_to_trade'])
-        print(amount, "amount")
-        sell_token = Web3.to_checksum_address(
-            context.user_data['trade_sell_token'])
-        buy_token = Web3.to_checksum_address(
-            context.user_data['trade_buy_token'])
-
-        wallet = await get_or_create_address(update)
-        owner_address = wallet.address_id
-        if sell_token.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            balance = w3.eth.get_balance(
-                Web3.to_checksum_address(
-                    owner_address))  # Fetch ETH balance# Fetch ETH balance
-        else:
-            balance = Decimal(wallet.balance(sell_token))
-        print(balance, amount)
-
-        slippage = context.user_data[
-            'slippage_for_trade'] if context.user_data.get(
-                'slippage_for_trade') else "5"
-
-        if (amount) <= 0:
-            await message.reply_text("Please enter a positive amount.")
-        elif amount > balance:
-            await message.reply_text(
-                f"Insufficient balance. Your current {sell_token} balance is {balance}."
-            )
-        else:
-            chain = 8453
-            tokens = [
-                f"0x4200000000000000000000000000000000000006:{chain}"
-                if sell_token.lower()
-                == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else
-                f"{Web3.to_checksum_address(sell_token)}:{chain}",
-                f"0x4200000000000000000000000000000000000006:{chain}"
-                if buy_token.lower()
-                == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else
-                f"{Web3.to_checksum_address(buy_token)}:{chain}"
-            ]
-
-            price_data = fetch_price_from_codex(tokens, chain)
-
-            sell_token_tocheck = "0x4200000000000000000000000000000000000006" if sell_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
-
-            if price_data[0]['token']['address'].lower(
-            ) == sell_token_tocheck.lower():
-                sell_element = price_data[0]
-                buy_element = price_data[1]
-            else:
-                sell_element = price_data[1]
-                buy_element = price_data[0]
-
-            # Debugging
-            print(f"Sell Token Address: {sell_token_tocheck}")
-            print(f"Sell Element: {sell_element}")
-            print(f"Buy Element: {buy_element}")
-            print("handle_trade_amount_click")
-
-            # Extracting values for the sell token
-            sell_symbol = sell_element['token']['symbol']
-            sell_price = sell_element['priceUSD']
-            sell_liquidity = sell_element['liquidity']
-            sell_market_cap = sell_element['marketCap']
-            sell_change1 = sell_element['change1']
-            sell_change24 = sell_element['change24']
-
-            # Extracting values for the buy token
-            buy_symbol = buy_element['token']['symbol']
-            buy_price = buy_element['priceUSD']
-            buy_liquidity = buy_element['liquidity']
-            buy_market_cap = buy_element['marketCap']
-            buy_change1 = buy_element['change1']
-            buy_change24 = buy_element['change24']
-
-            # Print for verification
-            print(f"Sell Symbol: {sell_symbol}, Buy Symbol: {buy_symbol}")
-
-            print(
-                f"First Token - Price: {sell_price}, Liquidity: {sell_liquidity}, Market Cap: {sell_market_cap}"
-            )
-            print(
-                f"Second Token - Price: {buy_price}, Liquidity: {buy_liquidity}, Market Cap: {buy_market_cap}"
-            )
-
-            sell_token_address = Web3.to_checksum_address(sell_token)
-            print(sell_token_address)
-
-            erc20_contract = None
-            # Create contract instance
-            if sell_token_address.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                sell_token_decimals = 18  # Directly use token decimal 18
-            else:
-                erc20_contract = w3.eth.contract(address=sell_token_address,
-                                                 abi=ERC20_ABI)
-                # Call decimals function inside a try block
-                sell_token_decimals = erc20_contract.functions.decimals().call(
-                )
-            print(sell_token_decimals)
-            converted_amount = int(amount * (10**sell_token_decimals))
-            # API Call parameters
-            wallet = await get_or_create_address(update)
-            private_key = wallet.key.key.hex()
-            account = Account.from_key(private_key)
-            nonce = w3.eth.get_transaction_count(account.address)
-            # Check if approval already given
-            if sell_token_address.lower(
-            ) != "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                current_allowance = erc20_contract.functions.allowance(
-                    owner_address,
-                    "0xfDAc2748713906ede00D023AA3E0Cc893828D30B").call()
-                if current_allowance >= converted_amount:
-                    await message.reply_text(
-                        "Approval already exists, no need for new approval.")
-                else:
-                    await message.reply_text("Processing token approval…")
-
-                    approve_tx = erc20_contract.functions.approve(
-                        "0xfDAc2748713906ede00D023AA3E0Cc893828D30B",
-                        converted_amount
-                    ).build_transaction({
-                        'chainId':
-                        8453,  # Adjust as necessary (1 for Ethereum mainnet)
-                        'gas': 200000,  # Provide an adequate gas limit
-                        'gasPrice':
-                        w3.eth.gas_price,  # Fetch current gas price
-                        'nonce': nonce,
-                    })
-                    # Sign the transaction
-                    signed_approve_tx = w3.eth.account.sign_transaction(
-                        approve_tx, private_key)
-                    try:
-                        tx_hash = w3.eth.send_raw_transaction(
-                            signed_approve_tx.raw_transaction)
-                        await message.reply_text(
-                            f"Successfully approved! Transaction hash: {tx_hash.hex()}"
-                        )
-                    except Exception as e:
-                        await message.reply_text(f"Approval failed: {str(e)}")
-
-            sell_token_address_to_check = sell_token.lower(
-            ) if sell_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else sell_token
-            buy_token_address_to_check = buy_token.lower() if buy_token.lower(
-            ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee" else buy_token
-            params = {
-                "slippage": str(slippage),
-                "amount": str(converted_amount
-                              ),  # The amount should be converted to string
-                "tokenIn": sell_token_address_to_check,
-                "tokenOut": buy_token_address_to_check,
-                "sender": owner_address,
-                "receiver": owner_address,
-                "chainId": 8453,
-                "skipSimulation": False,
-            }
-            print(params)
-            post_url = 'https://metasolvertest.velvetdao.xyz/best-quotes'
-            await message.reply_text("Fetching the quote…")
-            print("Two issue")
-            async with httpx.AsyncClient() as client:
-                try:
-                    response = await client.post(post_url, json=params)
-                    response.raise_for_status()
-                    # print(response.json())
-
-                except Exception as e:
-                    error_msg = f"Fail to fetch routes please retry {e}."
-                    print(error_msg)
-                    retry_keyboard = [[
-                        InlineKeyboardButton(
-                            "Retry", callback_data='trade_token_amount_click')
-                    ]]
-                    retry_reply_markup = InlineKeyboardMarkup(retry_keyboard)
-                    await message.reply_text(error_msg,
-                                             reply_markup=retry_reply_markup)
-                    return
-
-                keyboard = [[
-                    InlineKeyboardButton("Yes", callback_data='trade_yes'),
-                    InlineKeyboardButton("No", callback_data='trade_no')
-                ]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
-                # print(response.json())
-                meta_quote = response.json()
-                # print(meta_quote['quotes'][0])
-                context.user_data['meta_quote'] = meta_quote['quotes'][0]
-                context.user_data['buy_token_details'] = {
-                    'token_address': buy_token.lower(),
-                    'symbol': buy_symbol,
-                    'price': buy_price,
-                    'liquidity': buy_liquidity,
-                    'market_cap': buy_market_cap,
-                    'change1': buy_change1,
-                    'change24': buy_change24
-                }
-                best_quote = meta_quote['quotes'][0]['amountOut']
-                # print(best_quote)
-                try:
-                    # Convert address to checksum format
-                    buy_token_address = Web3.to_checksum_address(buy_token)
-                    print(buy_token_address)
-                    # Create contract instance
-
-                    if buy_token_address.lower(
-                    ) == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-                        buy_token_decimals = 18
-                    else:
-                        erc20_contract = w3.eth.contract(
-                            address=buy_token_address, abi=ERC20_ABI)
-                        # Call decimals function inside a try
-                        buy_token_decimals = erc20_contract.functions.decimals(
-                        ).call()
-
-                    print(buy_token_decimals)
-                    normal_amount = Decimal(best_quote) / Decimal(
-                        10**buy_token_decimals)
-
-                    price_impact = round(
-                        ((Decimal(buy_price) * Decimal(normal_amount)) /
-                         (Decimal(sell_price) * Decimal(amount)) - 1) * 100, 2)
-                    symbol = "+" if price_impact > 0 else "-"
-                    formatted_price_impact = f"{symbol}{abs(price_impact)}%"
-                    if price_impact > 0:
-                        colored_price_impact = f" {formatted_price_impact}"
-                    else:
-                        colored_price_impact = f" {formatted_price_impact}"
-                    buy_change1_symbol = "+" if float(buy_change1) > 0 else "-"
-                    buy_change1_formatted_price_impact = f"{buy_change1_symbol}{abs(round(float(buy_change1),6)):.6f}%"
-
-                    buy_change24_symbol = "+" if float(
-                        buy_change24) > 0 else "-"
-
-                    buy_change24_formatted_price_impact = f"{buy_change1_symbol}{abs(round(float(buy_change24),6)):.6f}%"
-
-                    sell_change1_symbol = "+" if float(
-                        sell_change1) > 0 else "-"
-                    sell_change1_formatted_price_impact = f"{sell_change1_symbol}{abs(round(float(sell_change1),6)):.6f}%"
-
-                    sell_change24_symbol = "+" if float(
-                        sell_change24) > 0 else "-"
-
-                    sell_change24_formatted_price_impact = f"{sell_change1_symbol}{abs(round(float(sell_change24),6)):.6f}%"
-
-                    await message.reply_text(
-                        f"Details ${sell_symbol} — ${buy_symbol} 📈 · 🔍\n"
-                        f"Token address: {sell_element['token']['address']}\n"
-                        f"Balance: {balance} ({sell_symbol})\n"
-                        f"Price: ${format_number(sell_price)} — LIQ: ${format_number(sell_liquidity)} — MC: ${format_number(sell_market_cap)}\n\n"
-                        f"1h: {sell_change1_formatted_price_impact} — 24h: {sell_change24_formatted_price_impact}\n\n"
-                        f"Token address: {buy_element['token']['address']}\n"
-                        f"Price: ${format_number(buy_price)} — LIQ: ${ format_number(buy_liquidity)} — MC: ${format_number(buy_market_cap)}\n\n"
-                        f"1h: {buy_change1_formatted_price_impact} — 24h: {buy_change24_formatted_price_impact}\n\n"
-                        # f"Renounced ✅\n\n"
-                        f"🟢 Fetched Quote (Velvet)\n"
-                        f"(${round(Decimal(sell_price) * Decimal(amount), 2)}) ↔️ "
-                        f" (${round(Decimal(buy_price) * Decimal(normal_amount), 2)})\n\n"
-                        f"Price Impact:{colored_price_impact}",
-                        reply_markup=reply_markup,
-                        parse_mode="HTML")
-                    # context.user_data['awaiting_trade_confirmation'] = True
-                except Exception as e:
-                    await message.reply_text(
-                        f"An error occurred when processing the token amount: {str(e)}"
-                    )
-        # Clear trade data
-        context.user_data['awaiting_trade_amount'] = False
-        context.user_data.pop('trade_sell_token', None)
-        context.user_data.pop('trade_buy_token', None)
-    except ValueError:
-        await message.reply_text("Invalid amount. Please enter a valid number."
-                                 )
+    await quote_trade_amount(update, context, message)
 
 
 async def handle_trade_yes(update: Update,
@@ -2102,33 +1963,8 @@ async def handle_trade_confirmation(update: Update,
     try:
         wallet = await get_or_create_address(update)
         private_key = wallet.key.key.hex()
-        provider_url = "https://open-platform.nodereal.io/3b8deb40026a4db88288217f675a5165/base"
-        w3 = Web3(Web3.HTTPProvider(provider_url))
         account = Account.from_key(private_key)
-        gas_price = w3.eth.gas_price
-        print(gas_price)
-        tx_data = {
-            "to":
-            meta_quote['to'],
-            "data":
-            meta_quote['data'],
-            "value":
-            int(meta_quote['value']),
-            "gas": (int(meta_quote['gasEstimate'] *
-                        2) if meta_quote['gasEstimate'] != 0 else 18000000),
-            "gasPrice":
-            int(gas_price),
-            "nonce":
-            w3.eth.get_transaction_count(account.address),
-            "from":
-            account.address,
-            "chainId":
-            8453,
-        }
-        # print(tx_data)
-
-        # Sign the transaction with the private key
-        signed_tx = w3.eth.account.sign_transaction(tx_data, private_key)
+        fees = await fee_oracle.fees()
 
         # Define the API URL
         url = "https://tbotserver.velvetdao.xyz/add-token"
@@ -2148,58 +1984,102 @@ async def handle_trade_confirmation(update: Update,
             "ngrok-skip-browser-warning": "69420"
         }
 
-        # Wait for the transaction receipt (confirm the transaction)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        async with nonce_manager.reserve(account.address) as nonce:
+            tx_data = {
+                "to":
+                meta_quote['to'],
+                "data":
+                meta_quote['data'],
+                "value":
+                int(meta_quote['value']),
+                "gas":
+                gas_limit(meta_quote['gasEstimate'], GAS_LIMIT_MARGIN),
+                "nonce":
+                nonce,
+                "from":
+                account.address,
+                "chainId":
+                8453,
+                **fees,
+            }
+
+            # Sign the transaction with the private key
+            signed_tx = Account.sign_transaction(tx_data, private_key)
+            tx_hash = await rpc_pool.call(
+                lambda w3: w3.eth.send_raw_transaction(signed_tx.raw_transaction))
         print(f"Transaction Hash: {tx_hash.hex()}")
+        trade_spend = context.user_data.pop('trade_spend', None)
+        if trade_spend:
+            quote_engine.record_swap(account.address, trade_spend['token'],
+                                     trade_spend['amount_in'])
         # Make the POST request
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = await http_client.post(url,
+                                              json=payload,
+                                              headers=headers)
             response.raise_for_status(
             )  # Raise an HTTPError for bad responses (4xx and 5xx)
             print("Response:", response.json())
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             print("Transaction completed fail to store token details for PnL:",
                   e)
 
         context.user_data['meta_quote'] = {}
         context.user_data['buy_token_details'] = {}
-        await query.message.reply_text(
-            f"Transaction completed with hash: \n"
-            f"https://basescan.org/tx/0x{tx_hash.hex()}")
+        pending_message = await query.message.reply_text(
+            f"Transaction submitted, waiting for confirmation…\n"
+            f"https://basescan.org/tx/{Web3.to_hex(tx_hash)}")
+        sender = account.address
+
+        def on_settled(success):
+            # A reverted, dropped or stuck swap may leave a gap in the local
+            # nonce counter; resync before the wallet's next transaction
+            if not success:
+                nonce_manager.reset(sender)
+
+        settlement_tracker.track(Web3.to_hex(tx_hash),
+                                 pending_message.chat_id,
+                                 pending_message.message_id,
+                                 "Transaction completed with hash: \n{link}",
+                                 "Transaction failed: {error}\n{link}",
+                                 on_settled=on_settled)
     except Exception as e:
         error_message = str(e)
         print(error_message)
         await query.message.reply_text(
             f"An error occurred during the trade: {error_message}")
-    context.user_data['awaiting_trade_confirmation'] = False
+
+
+def expect_input(context: ContextTypes.DEFAULT_TYPE, state,
+                 payload=None) -> None:
+    """Route the user's next text message to the handler for ``state``."""
+    conversation_for(context.user_data).expect(state,
+                                               payload,
+                                               ttl=CONVERSATION_TTL)
+
+
+MESSAGE_HANDLERS = {
+    ConversationState.WITHDRAW_AMOUNT: handle_withdraw_amount,
+    ConversationState.WITHDRAW_ADDRESS: handle_withdraw_address,
+    ConversationState.BUY_AMOUNT: handle_buy_amount,
+    ConversationState.BUY_ASSET: handle_buy_asset,
+    ConversationState.SELL_ASSET: handle_sell_asset,
+    ConversationState.SELL_AMOUNT: handle_sell_amount,
+    ConversationState.TRADE_SELL_TOKEN: handle_trade_sell_token,
+    ConversationState.TRADE_SELL_TOKEN_AUTO: handle_trade_sell_token_auto,
+    ConversationState.TRADE_BUY_TOKEN: handle_trade_buy_token,
+    ConversationState.TRADE_AMOUNT: handle_trade_amount,
+    ConversationState.TRADE_X_AMOUNT: handling_x_amount,
+    ConversationState.TRADE_X_SLIPPAGE: handling_x_slippage,
+}
 
 
 async def handle_message(update: Update,
                          context: ContextTypes.DEFAULT_TYPE) -> None:
-    if context.user_data.get('awaiting_withdraw_amount'):
-        await handle_withdraw_amount(update, context)
-    elif context.user_data.get('awaiting_withdraw_address'):
-        await handle_withdraw_address(update, context)
-    elif context.user_data.get('awaiting_trade_confirmation'):
-        await handle_trade_confirmation(update, context, query)
-    elif context.user_data.get('awaiting_buy_amount'):
-        await handle_buy_amount(update, context)
-    elif context.user_data.get('awaiting_x_amount'):
-        await handling_x_amount(update, context)
-    elif context.user_data.get('awaiting_buy_asset'):
-        await handle_buy_asset(update, context)
-    elif context.user_data.get('awaiting_sell_asset'):
-        await handle_sell_asset(update, context)
-    elif context.user_data.get('awaiting_trade_sell_token'):
-        await handle_trade_sell_token(update, context)
-    elif context.user_data.get('awaiting_trade_sell_token_auto'):
-        await handle_trade_sell_token_auto(update, context)
-    elif context.user_data.get('awaiting_sell_amount'):
-        await handle_sell_amount(update, context)
-    elif context.user_data.get('awaiting_trade_buy_token'):
-        await handle_trade_buy_token(update, context)
-    elif context.user_data.get('awaiting_trade_amount'):
-        await handle_trade_amount(update, context)
+    state = conversation_for(context.user_data).current()
+    handler = MESSAGE_HANDLERS.get(state)
+    if handler is not None:
+        await handler(update, context)
 
 
 from Crypto.Cipher import AES
@@ -2263,13 +2143,102 @@ def decrypt(encrypted_data: str, iv: str) -> dict:
     return result
 
 
+async def post_init(application: Application) -> None:
+    """Open shared network resources once the event loop is running."""
+    global http_client, wallet_pool
+    token_metadata.load()
+    http_client = create_http_client(
+        timeout=float(os.environ.get('HTTP_TIMEOUT', '30')),
+        connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5')),
+        max_connections=int(os.environ.get('HTTP_MAX_CONNECTIONS', '100')),
+        max_keepalive_connections=int(
+            os.environ.get('HTTP_MAX_KEEPALIVE', '20')))
+    price_service.client = http_client
+    quote_cache.client = http_client
+    await rpc_pool.start()
+    settlement_tracker.start(application.bot)
+    fee_oracle.start()
+    if price_feed.interval > 0:
+        price_feed.start()
+    if WALLET_POOL_SIZE > 0:
+        if hasattr(wallet_store.backend, 'claim'):
+            wallet_pool = WalletPool(
+                wallet_store,
+                create_pool_wallet,
+                size=WALLET_POOL_SIZE,
+                concurrency=int(os.environ.get('WALLET_POOL_CONCURRENCY',
+                                               '4')),
+                interval=float(os.environ.get('WALLET_POOL_INTERVAL', '30')))
+            wallet_pool.start()
+        else:
+            logger.warning(
+                "WALLET_POOL_SIZE is set but the wallet store cannot claim "
+                "records atomically; new wallets are created on demand")
+
+
+async def post_shutdown(application: Application) -> None:
+    """Release shared network resources."""
+    logger.info(f"Callback latency: {callback_router.histograms()}")
+    await settlement_tracker.stop()
+    await fee_oracle.stop()
+    await price_feed.stop()
+    if wallet_pool is not None:
+        await wallet_pool.stop()
+    await price_service.close()
+    await quote_cache.close()
+    if http_client is not None:
+        await http_client.aclose()
+    await rpc_pool.close()
+    cdp_executor.shutdown()
+    wallet_store.close()
+    token_metadata.flush()
+
+
+def check_wallet_store() -> None:
+    """
+    Refuse to start on an empty SQLite wallet store while the Replit database
+    still holds wallets: returning users would be given new wallets and lose
+    access to their funded ones.
+    """
+    if not isinstance(wallet_store.backend, SqliteStore):
+        return
+    if wallet_store.count() > wallet_store.count("pool:"):
+        return
+    if not ReplitStore.available():
+        return
+    try:
+        replit_keys = ReplitStore().keys()
+    except Exception as e:
+        raise RuntimeError(
+            "The wallet store is empty and the Replit database could not be "
+            f"checked for existing wallets ({e!r}). Run migrate_replit_db.py "
+            "or set WALLET_STORE_URL=replit: to keep using it.") from e
+    if replit_keys:
+        raise RuntimeError(
+            f"The wallet store is empty but the Replit database holds "
+            f"{len(replit_keys)} records. Run migrate_replit_db.py first, or "
+            "set WALLET_STORE_URL=replit: to keep using it.")
+
+
 def main() -> None:
     """Start the bot."""
+    check_wallet_store()
     # Initialize the CDP SDK
     Cdp.configure(cdp_api_key_name, cdp_api_key_private_key)
 
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(telegram_bot_token).build()
+    # Different chats are handled in parallel; one chat's updates stay in order
+    update_processor = PerUserUpdateProcessor(
+        int(os.environ.get('MAX_CONCURRENT_UPDATES', '64')))
+    # user_data (pending trades, prompts, slippage) survives restarts; dirty
+    # users are written together every PERSISTENCE_INTERVAL seconds
+    persistence = SqlitePersistence(
+        os.environ.get('PERSISTENCE_PATH', 'bot_state.db'),
+        update_interval=float(os.environ.get('PERSISTENCE_INTERVAL', '10')),
+        transient_keys=('positions_snapshot', ))
+    application = (Application.builder().token(telegram_bot_token).post_init(
+        post_init).post_shutdown(post_shutdown).concurrent_updates(
+            update_processor).persistence(persistence).build())
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
@@ -2287,12 +2256,34 @@ def main() -> None:
     application.add_handler(CommandHandler("referral", handle_button_referral))
     application.add_handler(CommandHandler("export", handle_button_export_key))
 
+    register_callback_routes(callback_router)
     application.add_handler(CallbackQueryHandler(button))
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    webhook_url = os.environ.get('TELEGRAM_WEBHOOK_URL')
+    if webhook_url:
+        # Telegram pushes updates to the embedded server; requests without
+        # the secret token header are rejected
+        url_path = os.environ.get('TELEGRAM_WEBHOOK_PATH', 'telegram')
+        webhook_secret = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+        if not webhook_secret:
+            # Without it anyone reaching the port could forge updates as
+            # any user, e.g. a withdrawal to their own address
+            raise RuntimeError(
+                "TELEGRAM_WEBHOOK_SECRET must be set to run in webhook mode")
+        application.run_webhook(
+            listen=os.environ.get('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.environ.get('TELEGRAM_WEBHOOK_PORT', '8443')),
+            url_path=url_path,
+            webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+            secret_token=webhook_secret,
+            max_connections=int(
+                os.environ.get('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', '40')),
+            allowed_updates=Update.ALL_TYPES)
+    else:
+        # Run the bot until the user presses Ctrl-C
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
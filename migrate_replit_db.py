@@ -0,0 +1,55 @@
+"""
+One-shot copy of the encrypted wallet records from the Replit database into
+the store main.py uses (WALLET_STORE_URL, a SQLite file by default).
+
+Run it once on Replit before switching the bot over:
+
+    python migrate_replit_db.py [--overwrite]
+
+Records already present in the target are kept unless --overwrite is given.
+"""
+import json
+import os
+import sys
+
+from src.storage import ReplitStore, open_store
+
+
+def migrate(source, target, overwrite=False, batch_size=500):
+    copied = skipped = invalid = 0
+    batch = []
+    for key in source.keys():
+        value = source.get(key)
+        try:
+            record = json.loads(value)
+        except (TypeError, ValueError):
+            record = None
+        if not isinstance(record, dict) or 'encrypted' not in record:
+            print(f"Skipping {key}: not a wallet record")
+            invalid += 1
+            continue
+        if not overwrite and key in target:
+            skipped += 1
+            continue
+        batch.append((key, value))
+        if len(batch) >= batch_size:
+            target.set_many(batch)
+            copied += len(batch)
+            batch = []
+    if batch:
+        target.set_many(batch)
+        copied += len(batch)
+    return copied, skipped, invalid
+
+
+if __name__ == '__main__':
+    target_url = os.environ.get('WALLET_STORE_URL', 'sqlite:///wallets.db')
+    target = open_store(target_url)
+    if not hasattr(target, 'set_many'):
+        sys.exit(f"Cannot migrate into {target_url}")
+    copied, skipped, invalid = migrate(ReplitStore(),
+                                       target,
+                                       overwrite='--overwrite' in sys.argv)
+    target.close()
+    print(f"Copied {copied} records to {target_url}, kept {skipped} existing, "
+          f"skipped {invalid} invalid")
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+
+MAX_UINT256 = 2**256 - 1
+
+
+class AllowanceCache:
+    def __init__(self, max_size=10000, ttl=600):
+        """
+        Last known ERC-20 allowance per (owner, token, spender), fed by allowance
+        reads and by our own approve and swap transactions, so a repeat sell of
+        the same token does not need to read the allowance again. Entries expire
+        after ``ttl`` seconds because the owner can change an allowance outside
+        the bot, e.g. with an exported key.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(owner, token, spender):
+        return (owner.lower(), token.lower(), spender.lower())
+
+    def get(self, owner, token, spender):
+        key = self._key(owner, token, spender)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, allowance = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return allowance
+
+    def put(self, owner, token, spender, allowance):
+        key = self._key(owner, token, spender)
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, allowance)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def spend(self, owner, token, spender, amount):
+        """Account for a swap pulling ``amount`` through the allowance."""
+        allowance = self.get(owner, token, spender)
+        if allowance is None:
+            return
+        # Most tokens leave an unlimited approval untouched
+        if allowance != MAX_UINT256:
+            self.put(owner, token, spender, max(allowance - amount, 0))
+
+    def invalidate(self, owner, token, spender):
+        self._entries.pop(self._key(owner, token, spender), None)
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Base for services that call ``run_once()`` every ``interval`` seconds in
+    a background task between ``start()`` and ``stop()``. A failed round is
+    logged as ``"<task_name> failed"`` and the loop carries on.
+    """
+    task_name = "Background task"
+    interval = 1
+    _task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning(f"{self.task_name} failed: {e!r}")
+            await self.wait()
+
+    async def wait(self):
+        """Pause between rounds; override to also wake up on demand."""
+        await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        raise NotImplementedError
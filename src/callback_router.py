@@ -0,0 +1,83 @@
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; the last bucket counts everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def as_dict(self):
+        labels = [f"<={bound}s" for bound in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class CallbackRouter:
+    def __init__(self, separator=":", slow_threshold=1.0):
+        """
+        Dispatches callback queries through a route table instead of an if/elif
+        chain. Callback data is ``namespace[:arg...]``; the namespace selects
+        the handler in O(1) and the remaining parts are passed as arguments.
+        Handler latency is recorded per namespace.
+        """
+        self.separator = separator
+        self.slow_threshold = slow_threshold
+        self._routes = {}
+        self._aliases = {}
+        self.latency = {}
+
+    def register(self, namespace, handler):
+        """Register ``handler(update, context, *args)`` for ``namespace``."""
+        self._routes[namespace] = handler
+        self.latency[namespace] = LatencyHistogram()
+
+    def alias(self, data, target):
+        """Map fixed callback data (e.g. from older keyboards) onto another one."""
+        self._aliases[data] = target
+
+    def parse(self, data):
+        data = self._aliases.get(data, data)
+        namespace, *args = data.split(self.separator)
+        return namespace, args
+
+    async def dispatch(self, update, context):
+        """Route the update's callback query; returns False when no route matches."""
+        namespace, args = self.parse(update.callback_query.data or "")
+        handler = self._routes.get(namespace)
+        if handler is None:
+            return False
+
+        started = time.perf_counter()
+        try:
+            await handler(update, context, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.latency[namespace].observe(elapsed)
+            if elapsed > self.slow_threshold:
+                logger.warning(
+                    f"Slow callback {namespace} took {elapsed:.2f}s")
+        return True
+
+    def histograms(self):
+        return {
+            namespace: histogram.as_dict()
+            for namespace, histogram in self.latency.items()
+            if histogram.count
+        }
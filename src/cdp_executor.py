@@ -0,0 +1,27 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .keyed_lock import KeyedLock
+
+
+class CdpExecutor:
+    def __init__(self, max_workers=16):
+        """
+        Runs the synchronous CDP SDK off the event loop on a bounded thread pool.
+        Calls for the same user are serialized so their wallet operations apply
+        in order, while different users proceed in parallel.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="cdp")
+        self._user_locks = KeyedLock()
+
+    async def run(self, user_id, fn, *args, **kwargs):
+        """Run blocking ``fn(*args, **kwargs)`` on the executor and await its result."""
+        async with self._user_locks[str(user_id)]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,59 @@
+import enum
+import time
+
+
+class ConversationState(enum.Enum):
+    IDLE = "idle"
+    WITHDRAW_AMOUNT = "withdraw_amount"
+    WITHDRAW_ADDRESS = "withdraw_address"
+    BUY_AMOUNT = "buy_amount"
+    BUY_ASSET = "buy_asset"
+    SELL_ASSET = "sell_asset"
+    SELL_AMOUNT = "sell_amount"
+    TRADE_SELL_TOKEN = "trade_sell_token"
+    TRADE_SELL_TOKEN_AUTO = "trade_sell_token_auto"
+    TRADE_BUY_TOKEN = "trade_buy_token"
+    TRADE_AMOUNT = "trade_amount"
+    TRADE_X_AMOUNT = "trade_x_amount"
+    TRADE_X_SLIPPAGE = "trade_x_slippage"
+
+
+class Conversation:
+    """
+    What the bot expects as the user's next text message: one state plus an
+    optional payload carried between steps (e.g. the amount while waiting for
+    the withdrawal address). Entering a state replaces the previous one, and a
+    state left unanswered for ``ttl`` seconds falls back to IDLE.
+    """
+    __slots__ = ("state", "payload", "expires_at")
+
+    def __init__(self):
+        self.state = ConversationState.IDLE
+        self.payload = None
+        self.expires_at = 0.0
+
+    def expect(self, state, payload=None, ttl=600):
+        self.state = state
+        self.payload = payload
+        # Wall clock rather than monotonic so the expiry stays meaningful if
+        # user_data is persisted across restarts
+        self.expires_at = time.time() + ttl
+
+    def reset(self):
+        self.state = ConversationState.IDLE
+        self.payload = None
+        self.expires_at = 0.0
+
+    def current(self):
+        if (self.state is not ConversationState.IDLE
+                and time.time() >= self.expires_at):
+            self.reset()
+        return self.state
+
+
+def conversation_for(user_data):
+    """Return the user's Conversation, creating it on first use."""
+    conversation = user_data.get("conversation")
+    if conversation is None:
+        conversation = user_data["conversation"] = Conversation()
+    return conversation
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import statistics
+import time
+
+from .background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def gas_limit(estimate, margin=1.5, fallback=18000000):
+    """Gas limit for a transaction from a quoted ``estimate`` plus ``margin``."""
+    estimate = int(estimate or 0)
+    if estimate <= 0:
+        return fallback
+    return int(estimate * margin)
+
+
+class FeeOracle(PeriodicTask):
+    task_name = "Fee history refresh"
+
+    def __init__(self,
+                 rpc_pool,
+                 interval=2,
+                 block_count=10,
+                 reward_percentile=50,
+                 base_fee_multiplier=2,
+                 min_priority_fee=1000000):
+        """
+        Keeps EIP-1559 fee estimates current from ``eth_feeHistory`` in the
+        background, so signing a transaction does not wait on a gas price RPC.
+
+        ``maxPriorityFeePerGas`` is the median of the ``reward_percentile`` tip
+        over the last ``block_count`` blocks (at least ``min_priority_fee``
+        wei). ``maxFeePerGas`` leaves room for the next block's base fee to
+        grow by ``base_fee_multiplier``; only the actual base fee is charged.
+        """
+        self.rpc_pool = rpc_pool
+        self.interval = interval
+        self.block_count = block_count
+        self.reward_percentile = reward_percentile
+        self.base_fee_multiplier = base_fee_multiplier
+        self.min_priority_fee = min_priority_fee
+        self.base_fee = None
+        self.priority_fee = None
+        self.updated_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    async def run_once(self):
+        await self.refresh()
+
+    async def refresh(self):
+        (history, ) = await self.rpc_pool.request_batch([
+            ("eth_feeHistory",
+             [hex(self.block_count), "latest", [self.reward_percentile]])
+        ])
+        # The last base fee is the one for the next block
+        self.base_fee = int(history['baseFeePerGas'][-1], 16)
+        rewards = [
+            int(block[0], 16) for block in history.get('reward') or []
+            if block
+        ]
+        self.priority_fee = max(
+            int(statistics.median(rewards)) if rewards else 0,
+            self.min_priority_fee)
+        self.updated_at = time.monotonic()
+
+    async def fees(self):
+        """
+        Current ``maxFeePerGas``/``maxPriorityFeePerGas`` as transaction fields.
+        Served from the cache; refreshed inline only when it is stale, e.g.
+        before the background task's first round.
+        """
+        if time.monotonic() - self.updated_at > self.interval * 3:
+            async with self._refresh_lock:
+                if time.monotonic() - self.updated_at > self.interval * 3:
+                    await self.refresh()
+        return {
+            'maxFeePerGas':
+            self.base_fee * self.base_fee_multiplier + self.priority_fee,
+            'maxPriorityFeePerGas': self.priority_fee,
+        }
+
+    async def effective_gas_price(self):
+        """Expected price per gas actually paid: next base fee plus tip."""
+        await self.fees()
+        return self.base_fee + self.priority_fee
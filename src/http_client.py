@@ -0,0 +1,59 @@
+import importlib.util
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available():
+    """httpx only speaks HTTP/2 when the optional ``h2`` package is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def create_http_client(timeout=30,
+                       connect_timeout=5,
+                       max_connections=100,
+                       max_keepalive_connections=20,
+                       keepalive_expiry=60):
+    """
+    One pooled client for all outgoing HTTP APIs (metasolver, tbotserver,
+    Codex), so repeated calls reuse warm TLS connections instead of paying a
+    handshake per request. HTTP/2 is used when ``h2`` is available.
+    """
+    http2 = http2_available()
+    if not http2:
+        logger.warning(
+            "The h2 package is not installed; outgoing HTTP falls back to "
+            "HTTP/1.1 without request multiplexing")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry),
+    )
+
+
+class HttpClientUser:
+    """
+    Base for services that send requests through ``self.client``. A shared
+    client may be assigned and is not closed here; otherwise one is created
+    on first use (with ``request_timeout``) and closed by ``close()``.
+    """
+    client = None
+    request_timeout = 30
+    _owns_client = False
+
+    def http(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.request_timeout)
+            self._owns_client = True
+        return self.client
+
+    async def close(self):
+        if self._owns_client:
+            await self.client.aclose()
+            self.client = None
+            self._owns_client = False
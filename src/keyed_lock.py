@@ -0,0 +1,23 @@
+import asyncio
+import weakref
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, e.g. per user or per wallet:
+
+        async with locks[key]:
+            ...
+
+    A key's lock disappears once no task holds or waits on it.
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def __getitem__(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
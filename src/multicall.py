@@ -0,0 +1,136 @@
+from eth_abi import decode, encode
+from web3 import Web3
+
+# Multicall3 is deployed at the same address on Base and most EVM chains
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+GET_ETH_BALANCE_SELECTOR = bytes.fromhex("4d2301cc")
+DECIMALS_SELECTOR = bytes.fromhex("313ce567")
+SYMBOL_SELECTOR = bytes.fromhex("95d89b41")
+NAME_SELECTOR = bytes.fromhex("06fdde03")
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")
+ALLOWANCE_SELECTOR = bytes.fromhex("dd62ed3e")
+
+
+def _decode_uint(data):
+    return decode(["uint256"], data)[0]
+
+
+def _decode_uint8(data):
+    # Rejects any word above 255, e.g. from a fallback function answering
+    # decimals() with arbitrary data
+    return decode(["uint8"], data)[0]
+
+
+def _decode_text(data):
+    # Some older tokens return bytes32 instead of string for symbol()/name()
+    try:
+        return decode(["string"], data)[0]
+    except Exception:
+        return data[:32].rstrip(b"\x00").decode("utf-8", errors="ignore")
+
+
+class BatchCall:
+    def __init__(self, decoder, on_result=None):
+        self.decoder = decoder
+        self.on_result = on_result
+        self.value = None
+
+    def resolve(self, raw):
+        self.value = self.decoder(raw)
+        if self.value is not None and self.on_result is not None:
+            self.on_result(self.value)
+
+
+class ReadBatch:
+    def __init__(self, rpc_pool, block="latest"):
+        """
+        Collects the read calls needed for one request and sends them in a single
+        JSON-RPC batch, with every contract read folded into one Multicall3
+        aggregate3 call. Failed contract reads resolve to None.
+        """
+        self.rpc_pool = rpc_pool
+        self.block = block
+        self._contract_calls = []
+        self._rpc_calls = []
+
+    def _add_contract_call(self, target, calldata, decoder):
+        call = BatchCall(decoder)
+        self._contract_calls.append(
+            (Web3.to_checksum_address(target), calldata, call))
+        return call
+
+    def _add_rpc_call(self, method, params, decoder):
+        call = BatchCall(decoder)
+        self._rpc_calls.append((method, params, call))
+        return call
+
+    def eth_balance(self, owner):
+        return self._add_contract_call(
+            MULTICALL3_ADDRESS,
+            GET_ETH_BALANCE_SELECTOR + encode(["address"], [owner]),
+            _decode_uint)
+
+    def decimals(self, token):
+        return self._add_contract_call(token, DECIMALS_SELECTOR, _decode_uint8)
+
+    def symbol(self, token):
+        return self._add_contract_call(token, SYMBOL_SELECTOR, _decode_text)
+
+    def name(self, token):
+        return self._add_contract_call(token, NAME_SELECTOR, _decode_text)
+
+    def balance_of(self, token, owner):
+        return self._add_contract_call(
+            token, BALANCE_OF_SELECTOR + encode(["address"], [owner]),
+            _decode_uint)
+
+    def allowance(self, token, owner, spender):
+        return self._add_contract_call(
+            token,
+            ALLOWANCE_SELECTOR + encode(["address", "address"],
+                                        [owner, spender]), _decode_uint)
+
+    def gas_price(self):
+        return self._add_rpc_call("eth_gasPrice", [],
+                                  lambda result: int(result, 16))
+
+    def transaction_count(self, address, block="latest"):
+        return self._add_rpc_call("eth_getTransactionCount",
+                                  [Web3.to_checksum_address(address), block],
+                                  lambda result: int(result, 16))
+
+    def _aggregate3_calldata(self):
+        calls = [(target, True, calldata)
+                 for target, calldata, _ in self._contract_calls]
+        return AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"],
+                                            [calls])
+
+    async def execute(self):
+        """Send every collected call in one round trip and fill in each ``.value``."""
+        rpc_requests = [(method, params)
+                            for method, params, _ in self._rpc_calls]
+        if self._contract_calls:
+            rpc_requests.append(("eth_call", [{
+                "to": MULTICALL3_ADDRESS,
+                "data": "0x" + self._aggregate3_calldata().hex()
+            }, self.block]))
+        if not rpc_requests:
+            return
+
+        results = await self.rpc_pool.request_batch(rpc_requests)
+
+        for (_, _, call), result in zip(self._rpc_calls, results):
+            call.resolve(result)
+
+        if self._contract_calls:
+            return_data = decode(["(bool,bytes)[]"],
+                                 bytes.fromhex(results[-1][2:]))[0]
+            for (_, _, call), (success, data) in zip(self._contract_calls,
+                                                     return_data):
+                if success and data:
+                    try:
+                        call.resolve(data)
+                    except Exception:
+                        call.value = None
@@ -0,0 +1,70 @@
+import contextlib
+
+from web3 import Web3
+
+from .keyed_lock import KeyedLock
+
+
+class NonceManager:
+    def __init__(self, rpc_pool):
+        """
+        Hands out transaction nonces per account from memory, so consecutive
+        sends (approve then swap, double taps) neither repeat an RPC nor
+        collide. Sends for one account are serialized. The local counter is
+        synced from the ``pending`` transaction count on first use and after
+        any failed send, and is dropped when something else (e.g. a CDP
+        transfer) sends from the same account or when a sent transaction
+        reverts or is not mined in time.
+        """
+        self.rpc_pool = rpc_pool
+        self._next = {}
+        # Bumped by reset(), so a reservation in flight cannot write back a
+        # counter that was dropped meanwhile
+        self._generation = {}
+        self._locks = KeyedLock()
+
+    def known(self, address):
+        return address.lower() in self._next
+
+    def seed(self, address, pending_count):
+        """Use an already fetched ``pending`` count unless a nonce is tracked."""
+        self._next.setdefault(address.lower(), pending_count)
+
+    def reset(self, address):
+        key = address.lower()
+        self._next.pop(key, None)
+        self._generation[key] = self._generation.get(key, 0) + 1
+
+    async def _sync(self, address):
+        (count, ) = await self.rpc_pool.request_batch([
+            ("eth_getTransactionCount",
+             [Web3.to_checksum_address(address), "pending"])
+        ])
+        return int(count, 16)
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, address):
+        """
+        Reserve the account's next nonce for signing and sending one transaction:
+
+            async with nonce_manager.reserve(address) as nonce:
+                ...
+
+        The nonce is consumed when the block exits normally; if it raises, the
+        account is resynced from the node before its next transaction.
+        """
+        key = address.lower()
+        async with self._locks[key]:
+            generation = self._generation.get(key, 0)
+            nonce = self._next.get(key)
+            if nonce is None:
+                nonce = await self._sync(address)
+                if self._generation.get(key, 0) == generation:
+                    self._next[key] = nonce
+            try:
+                yield nonce
+            except BaseException:
+                self._next.pop(key, None)
+                raise
+            if self._generation.get(key, 0) == generation:
+                self._next[key] = nonce + 1
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .storage import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self,
+                 path,
+                 update_interval=10,
+                 transient_keys=(),
+                 store_data=None):
+        """
+        Keeps ``user_data``, ``chat_data``, ``bot_data`` and ConversationHandler
+        states in a SQLite file so a restart does not drop users mid-flow.
+
+        The Application already collects the users and chats touched since its
+        last run and hands them over every ``update_interval`` seconds; each
+        such round is written in a single transaction off the event loop.
+        Records are stored as binary pickles, and a record whose bytes did not
+        change since the last write is skipped. Keys in ``transient_keys``
+        (short-lived caches) are left out.
+        """
+        super().__init__(store_data=store_data
+                         or PersistenceInput(callback_data=False),
+                         update_interval=update_interval)
+        self.store = SqliteStore(path)
+        self.transient_keys = tuple(transient_keys)
+        self._pending = {}
+        self._written = {}
+        self._conversations = {}
+        self._writer = None
+
+    def _dumps(self, data):
+        if isinstance(data, dict) and self.transient_keys:
+            data = {
+                key: value
+                for key, value in data.items()
+                if key not in self.transient_keys
+            }
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _load(self, prefix):
+        loaded = {}
+        for key, value in self.store.items(prefix):
+            try:
+                loaded[key[len(prefix):]] = pickle.loads(value)
+            except Exception as e:
+                logger.warning(f"Dropping unreadable record {key}: {e!r}")
+                continue
+            self._written[key] = hash(value)
+        return loaded
+
+    def _queue(self, key, data):
+        """Stage a record (``None`` deletes it) for the next batched write."""
+        value = None if data is None else self._dumps(data)
+        if value is not None and self._written.get(key) == hash(value):
+            self._pending.pop(key, None)
+            return
+        self._pending[key] = value
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # The Application hands over a whole round at once; yield so every
+        # record of the round is staged before writing
+        await asyncio.sleep(0)
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except Exception as e:
+                logger.warning(f"Persisting {len(pending)} records failed, "
+                               f"will retry: {e!r}")
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+                return
+
+    def _write(self, pending):
+        upserts = [(key, value) for key, value in pending.items()
+                   if value is not None]
+        deletes = [key for key, value in pending.items() if value is None]
+        if upserts:
+            self.store.set_many(upserts)
+        if deletes:
+            self.store.delete_many(deletes)
+        for key, value in pending.items():
+            if value is None:
+                self._written.pop(key, None)
+            else:
+                self._written[key] = hash(value)
+
+    async def get_user_data(self):
+        return {
+            int(user_id): data
+            for user_id, data in self._load("user:").items()
+        }
+
+    async def get_chat_data(self):
+        return {
+            int(chat_id): data
+            for chat_id, data in self._load("chat:").items()
+        }
+
+    async def get_bot_data(self):
+        return self._load("bot").get("", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        if name not in self._conversations:
+            stored = self._load(f"conversations:{name}").get("", {})
+            self._conversations[name] = stored
+        return dict(self._conversations[name])
+
+    async def update_conversation(self, name, key, new_state):
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._queue(f"conversations:{name}", conversations)
+
+    async def update_user_data(self, user_id, data):
+        self._queue(f"user:{user_id}", data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._queue(f"chat:{chat_id}", data)
+
+    async def update_bot_data(self, data):
+        self._queue("bot", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._queue(f"user:{user_id}", None)
+
+    async def drop_chat_data(self, chat_id):
+        self._queue(f"chat:{chat_id}", None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Write whatever is still staged and close the database."""
+        if self._writer is not None:
+            await self._writer
+            self._writer = None
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write, pending)
+        self.store.close()
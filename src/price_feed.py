@@ -0,0 +1,70 @@
+import logging
+import time
+from collections import Counter
+
+from .background import PeriodicTask
+from .price_service import price_key
+
+logger = logging.getLogger(__name__)
+
+
+class PriceFeed(PeriodicTask):
+    task_name = "Price feed refresh"
+
+    def __init__(self,
+                 price_service,
+                 interval=5,
+                 top_n=50,
+                 held_ttl=3600,
+                 trade_half_life=3600):
+        """
+        Background poller that keeps the price cache warm for the ``top_n`` most
+        traded tokens and for tokens recently seen in users' positions, so trade
+        screens render from memory. Every tracked token is refreshed with one
+        batched filterTokens call per ``interval`` seconds, and cached until
+        well past the next round regardless of the price cache's own TTL.
+
+        Trade counts halve every ``trade_half_life`` seconds, so the ranking
+        follows what is traded now and rarely traded tokens are dropped.
+        """
+        self.price_service = price_service
+        self.interval = interval
+        self.top_n = top_n
+        self.held_ttl = held_ttl
+        self.trade_half_life = trade_half_life
+        self._trade_counts = Counter()
+        self._held = {}
+
+    def record_trade(self, tokens):
+        for token in tokens:
+            self._trade_counts[price_key(token)] += 1
+
+    def record_positions(self, tokens):
+        now = time.monotonic()
+        for token in tokens:
+            self._held[price_key(token)] = now
+
+    def _decay_trades(self):
+        factor = 0.5**(self.interval / self.trade_half_life)
+        self._trade_counts = Counter({
+            key: count * factor
+            for key, count in self._trade_counts.items()
+            if count * factor >= 0.5
+        })
+
+    def tracked(self):
+        cutoff = time.monotonic() - self.held_ttl
+        self._held = {
+            key: seen
+            for key, seen in self._held.items() if seen >= cutoff
+        }
+        top = [key for key, _ in self._trade_counts.most_common(self.top_n)]
+        return list(dict.fromkeys(top + list(self._held)))
+
+    async def run_once(self):
+        tokens = self.tracked()
+        self._decay_trades()
+        if tokens:
+            # Warmed prices must outlive the gap until the next round
+            await self.price_service.refresh(
+                tokens, ttl=self.interval + self.price_service.ttl)
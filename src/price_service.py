@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+
+from .http_client import HttpClientUser
+
+logger = logging.getLogger(__name__)
+
+FILTER_TOKENS_QUERY = """
+query {{
+  filterTokens(
+    tokens: [{token_inputs}],
+    limit: {limit}
+  ) {{
+    results {{
+      token {{
+        address
+        decimals
+        name
+        networkId
+        symbol
+      }}
+      marketCap
+      holders
+      priceUSD
+      liquidity
+      change1
+      change24
+      createdAt
+    }}
+  }}
+}}
+"""
+
+
+def price_key(token):
+    """Normalize ``address:networkId`` so lookups are case-insensitive."""
+    address, network_id = token.split(":")
+    return f"{address.lower()}:{int(network_id)}"
+
+
+class PriceService(HttpClientUser):
+    def __init__(self,
+                 api_url,
+                 api_key,
+                 token_metadata=None,
+                 ttl=10,
+                 batch_window=0.02,
+                 max_batch=200,
+                 request_timeout=10,
+                 max_entries=10000,
+                 client=None):
+        """
+        Async Codex price lookups with a short-TTL cache per ``address:networkId``.
+        Concurrent requests for the same token share one in-flight lookup, and
+        lookups arriving within ``batch_window`` seconds are merged into a
+        single filterTokens request of up to ``max_batch`` tokens.
+
+        ``client`` may be a shared httpx.AsyncClient; it is not closed here.
+        """
+        self.api_url = api_url
+        self.api_key = api_key
+        self.token_metadata = token_metadata
+        self.ttl = ttl
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.request_timeout = request_timeout
+        self.max_entries = max_entries
+        self.client = client
+        self._cache = {}
+        self._inflight = {}
+        self._queued = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    def cached(self, token):
+        """Return a fresh cached result for ``token`` without any network call."""
+        entry = self._cache.get(price_key(token))
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        return None
+
+    async def get_prices(self, tokens):
+        """
+        Look up ``address:networkId`` tokens.
+
+        :return: filterTokens results in the order requested; unknown tokens are skipped
+        """
+        waiting = []
+        for token in tokens:
+            key = price_key(token)
+            result = self.cached(key)
+            if result is not None:
+                waiting.append(result)
+                continue
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._inflight[key] = future
+                self._enqueue(key)
+            waiting.append(future)
+
+        results = []
+        for item in waiting:
+            result = await asyncio.shield(item) if isinstance(
+                item, asyncio.Future) else item
+            if result is not None:
+                results.append(result)
+        return results
+
+    def _enqueue(self, key):
+        self._queued.append(key)
+        if len(self._queued) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._queued:
+            keys = self._queued[:self.max_batch]
+            del self._queued[:self.max_batch]
+            task = asyncio.create_task(self._fetch_batch(keys))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_batch(self, keys):
+        try:
+            results = await self.fetch(keys)
+        except Exception as e:
+            logger.error(f"Failed to fetch price from codex: {e}")
+            results = {}
+        for key in keys:
+            future = self._inflight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(results.get(key))
+
+    async def refresh(self, tokens, ttl=None):
+        """
+        Re-fetch ``tokens`` regardless of cache state, ``max_batch`` per
+        request, caching them for ``ttl`` seconds instead of the default.
+        """
+        keys = list(dict.fromkeys(price_key(token) for token in tokens))
+        for i in range(0, len(keys), self.max_batch):
+            await self.fetch(keys[i:i + self.max_batch], ttl=ttl)
+
+    async def fetch(self, keys, ttl=None):
+        """Fetch ``keys`` in one filterTokens request and refresh the cache."""
+        token_inputs = '\n'.join([f'"{key}"' for key in keys])
+        query = FILTER_TOKENS_QUERY.format(token_inputs=token_inputs,
+                                           limit=self.max_batch)
+        response = await self.http().post(
+            self.api_url,
+            json={"query": query},
+            headers={
+                "Authorization": self.api_key,
+                "Content-Type": "application/json",
+            },
+        )
+        response.raise_for_status()
+        filter_tokens = response.json().get("data", {}).get(
+            "filterTokens", {}).get("results", [])
+
+        if self.token_metadata is not None:
+            self.token_metadata.update_from_codex(filter_tokens)
+
+        now = time.monotonic()
+        if len(self._cache) > self.max_entries:
+            self._cache = {
+                key: entry
+                for key, entry in self._cache.items() if entry[0] > now
+            }
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        results = {}
+        for result in filter_tokens:
+            token = result['token']
+            key = f"{token['address'].lower()}:{int(token['networkId'])}"
+            results[key] = result
+            self._cache[key] = (expires_at, result)
+        return results
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+from .http_client import HttpClientUser
+
+logger = logging.getLogger(__name__)
+
+
+def quote_key(params):
+    """Cache key for a quote request; addresses compare case-insensitively."""
+    return tuple(sorted((name, str(value).lower())
+                        for name, value in params.items()))
+
+
+class QuoteCache(HttpClientUser):
+    def __init__(self,
+                 api_url,
+                 ttl=15,
+                 max_entries=1024,
+                 request_timeout=30,
+                 client=None):
+        """
+        Short-lived cache of metasolver ``/best-quotes`` responses keyed by the
+        request parameters. ``prefetch`` starts quotes in the background for
+        amounts the user is likely to pick; ``get`` returns a fresh cached
+        quote, joins a lookup that is still in flight, or fetches a new one.
+
+        ``client`` may be a shared httpx.AsyncClient; it is not closed here.
+        """
+        self.api_url = api_url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.request_timeout = request_timeout
+        self.client = client
+        self._cache = {}
+        self._inflight = {}
+
+    def cached(self, params):
+        entry = self._cache.get(quote_key(params))
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        return None
+
+    async def get(self, params):
+        quote = self.cached(params)
+        if quote is not None:
+            return quote
+        task = self._inflight.get(quote_key(params))
+        if task is None:
+            task = self._start(params)
+        # A cancelled caller must not cancel a lookup other callers share
+        return await asyncio.shield(task)
+
+    def prefetch(self, params_list):
+        """Start background lookups for quotes that are neither cached nor in flight."""
+        for params in params_list:
+            if (self.cached(params) is None
+                    and quote_key(params) not in self._inflight):
+                self._start(params)
+
+    def _start(self, params):
+        key = quote_key(params)
+        task = asyncio.create_task(self.fetch(params))
+        self._inflight[key] = task
+
+        def done(task):
+            self._inflight.pop(key, None)
+            if not task.cancelled() and task.exception() is not None:
+                logger.debug(f"Quote lookup failed: {task.exception()!r}")
+
+        task.add_done_callback(done)
+        return task
+
+    async def fetch(self, params):
+        """Request a quote and cache the response."""
+        response = await self.http().post(self.api_url, json=params)
+        response.raise_for_status()
+        quote = response.json()
+
+        now = time.monotonic()
+        if len(self._cache) > self.max_entries:
+            self._cache = {
+                key: entry
+                for key, entry in self._cache.items() if entry[0] > now
+            }
+        self._cache[quote_key(params)] = (now + self.ttl, quote)
+        return quote
@@ -0,0 +1,337 @@
+import asyncio
+from decimal import Decimal
+
+from eth_abi import encode
+from eth_account import Account
+from web3 import Web3
+
+from .allowance_cache import MAX_UINT256
+from .fee_oracle import gas_limit
+from .multicall import ReadBatch
+from .token_metadata import NATIVE_TOKEN_ADDRESS, WETH_ADDRESS
+
+APPROVE_SELECTOR = bytes.fromhex("095ea7b3")
+
+
+class QuoteError(Exception):
+    pass
+
+
+def is_native(token):
+    return token.lower() == NATIVE_TOKEN_ADDRESS
+
+
+def to_base_units(amount, decimals):
+    return int(amount * (10**decimals))
+
+
+def quote_params(sell_token, buy_token, amount_in, slippage, owner_address,
+                 chain_id=8453):
+    """Metasolver /best-quotes request for ``amount_in`` sell-token base units."""
+    def quote_token(token):
+        if is_native(token):
+            return token.lower()
+        return Web3.to_checksum_address(token)
+
+    return {
+        "slippage": str(slippage),
+        "amount": str(amount_in),
+        "tokenIn": quote_token(sell_token),
+        "tokenOut": quote_token(buy_token),
+        "sender": owner_address,
+        "receiver": owner_address,
+        "chainId": chain_id,
+        "skipSimulation": False,
+    }
+
+
+class QuoteResult:
+    def __init__(self, owner_address, sell_token, buy_token, amount):
+        """
+        Everything needed to show and execute one trade: on-chain state read in
+        ``QuoteEngine.prepare`` and the route filled in by ``QuoteEngine.quote``.
+        Token amounts are in token units; ``amount_in`` is in base units.
+        """
+        self.owner_address = owner_address
+        self.sell_token = sell_token
+        self.buy_token = buy_token
+        self.amount = amount
+        self.amount_in = None
+        self.balance = None
+        self.sell_decimals = None
+        self.buy_decimals = None
+        self.allowance = None
+        # Expected wei paid per gas, used to value each route's gas cost
+        self.gas_price = None
+        # Codex filterTokens results for each side
+        self.sell_market = None
+        self.buy_market = None
+        self.eth_market = None
+        self.slippage = None
+        self.route = None
+        self.amount_out = None
+        self.price_impact = None
+        # Every route considered, best first, as (net_value_usd, slippage, route)
+        self.ranked_routes = []
+
+    @property
+    def needs_approval(self):
+        return (not is_native(self.sell_token)
+                and (self.allowance or 0) < self.amount_in)
+
+    @property
+    def sell_value_usd(self):
+        return Decimal(self.sell_market['priceUSD']) * Decimal(self.amount)
+
+    @property
+    def buy_value_usd(self):
+        return Decimal(self.buy_market['priceUSD']) * self.amount_out
+
+    @property
+    def gas_cost_usd(self):
+        return route_gas_cost_usd(self.route, self.gas_price, self.eth_market)
+
+
+def route_gas_cost_usd(route, gas_price, eth_market):
+    """
+    USD cost of the route's ``gasEstimate`` at ``gas_price``; 0 without an ETH
+    price. A route without an estimate is charged the fallback gas limit, so
+    it does not outrank routes that report their gas.
+    """
+    if eth_market is None:
+        return Decimal(0)
+    gas_wei = gas_limit(route.get('gasEstimate'), margin=1) * gas_price
+    return Decimal(gas_wei) / Decimal(10**18) * Decimal(eth_market['priceUSD'])
+
+
+class QuoteEngine:
+    def __init__(self,
+                 rpc_pool,
+                 price_service,
+                 quote_cache,
+                 token_metadata,
+                 nonce_manager,
+                 fee_oracle,
+                 allowance_cache,
+                 settlement_tracker,
+                 spender,
+                 chain_id=8453,
+                 slippage_levels=(),
+                 approve_max=False):
+        """
+        Computes trade quotes independently of Telegram: balances, decimals,
+        allowance and prices for a token pair, then the metasolver route and
+        its price impact. ``spender`` is the router that needs the allowance.
+
+        Every returned route is ranked by output value net of its gas cost.
+        ``slippage_levels`` are extra slippages quoted in parallel with the
+        user's; only levels at or below the user's slippage are used.
+
+        Allowances come from ``allowance_cache`` when it already covers the
+        amount; an approval is only cached once ``settlement_tracker`` sees
+        it confirmed. With ``approve_max`` approvals are unlimited, so later
+        sells of the same token skip both the approval and the allowance read.
+        """
+        self.rpc_pool = rpc_pool
+        self.price_service = price_service
+        self.quote_cache = quote_cache
+        self.token_metadata = token_metadata
+        self.nonce_manager = nonce_manager
+        self.fee_oracle = fee_oracle
+        self.allowance_cache = allowance_cache
+        self.settlement_tracker = settlement_tracker
+        self.spender = spender
+        self.chain_id = chain_id
+        self.slippage_levels = slippage_levels
+        self.approve_max = approve_max
+
+    def _cached_allowance(self, owner_address, sell_token, amount):
+        """Cached allowance if it is known to cover ``amount``, else None."""
+        allowance = self.allowance_cache.get(owner_address, sell_token,
+                                             self.spender)
+        decimals = self.token_metadata.decimals(sell_token)
+        if (allowance is not None and decimals is not None
+                and allowance >= to_base_units(amount, decimals)):
+            return allowance
+        return None
+
+    def _market_key(self, token):
+        address = WETH_ADDRESS if is_native(token) else token
+        return f"{address.lower()}:{self.chain_id}"
+
+    async def prepare(self, owner_address, sell_token, buy_token, amount):
+        """Read balance, decimals, allowance, prices and the gas price concurrently."""
+        result = QuoteResult(owner_address, sell_token, buy_token, amount)
+
+        reads = ReadBatch(self.rpc_pool)
+        if is_native(sell_token):
+            balance_read = reads.eth_balance(owner_address)
+        else:
+            balance_read = reads.balance_of(sell_token, owner_address)
+            sell_decimals_read = self.token_metadata.read_decimals(
+                reads, sell_token)
+            result.allowance = self._cached_allowance(owner_address,
+                                                      sell_token, amount)
+            allowance_read = None
+            if result.allowance is None:
+                allowance_read = reads.allowance(sell_token, owner_address,
+                                                 self.spender)
+        if not is_native(buy_token):
+            buy_decimals_read = self.token_metadata.read_decimals(
+                reads, buy_token)
+        # Seed the nonce manager while we are at it, in case an approval follows
+        nonce_read = None
+        if not self.nonce_manager.known(owner_address):
+            nonce_read = reads.transaction_count(owner_address, "pending")
+
+        sell_key = self._market_key(sell_token)
+        buy_key = self._market_key(buy_token)
+        # ETH price values each route's gas cost
+        eth_key = self._market_key(WETH_ADDRESS)
+        _, markets, result.gas_price = await asyncio.gather(
+            reads.execute(),
+            self.price_service.get_prices(
+                list(dict.fromkeys([sell_key, buy_key, eth_key]))),
+            self.fee_oracle.effective_gas_price())
+
+        if is_native(sell_token):
+            result.sell_decimals = 18
+        else:
+            result.sell_decimals = sell_decimals_read.value
+            if allowance_read is not None and allowance_read.value is not None:
+                result.allowance = allowance_read.value
+                self.allowance_cache.put(owner_address, sell_token,
+                                         self.spender, result.allowance)
+        result.buy_decimals = 18 if is_native(
+            buy_token) else buy_decimals_read.value
+        if result.sell_decimals is None or result.buy_decimals is None:
+            raise QuoteError("Could not read token decimals.")
+        result.balance = Decimal(balance_read.value) / Decimal(
+            10**result.sell_decimals)
+        result.amount_in = to_base_units(amount, result.sell_decimals)
+        if nonce_read is not None and nonce_read.value is not None:
+            self.nonce_manager.seed(owner_address, nonce_read.value)
+
+        by_key = {
+            self._market_key(market['token']['address']): market
+            for market in markets
+        }
+        result.sell_market = by_key.get(sell_key)
+        result.buy_market = by_key.get(buy_key)
+        result.eth_market = by_key.get(eth_key)
+        if result.sell_market is None or result.buy_market is None:
+            raise QuoteError("Price data is not available for this pair.")
+        return result
+
+    async def approve(self, result, private_key):
+        """Approve the spender for the trade (or without limit) and return the tx hash."""
+        amount = MAX_UINT256 if self.approve_max else result.amount_in
+        data = APPROVE_SELECTOR + encode(["address", "uint256"],
+                                         [self.spender, amount])
+        fees = await self.fee_oracle.fees()
+        async with self.nonce_manager.reserve(result.owner_address) as nonce:
+            approve_tx = {
+                'to': Web3.to_checksum_address(result.sell_token),
+                'data': Web3.to_hex(data),
+                'value': 0,
+                'chainId': self.chain_id,
+                'gas': 200000,  # Provide an adequate gas limit
+                'nonce': nonce,
+                **fees,
+            }
+            signed_approve_tx = Account.sign_transaction(
+                approve_tx, private_key)
+            tx_hash = await self.rpc_pool.call(
+                lambda w3: w3.eth.send_raw_transaction(
+                    signed_approve_tx.raw_transaction))
+        # The swap is sent with the next nonce, so it executes after this.
+        # Later sells trust the allowance only once the approve is mined, and
+        # only an unlimited one: an exact approval is used up by this swap,
+        # which may be mined before we see the approve's receipt
+        owner_address, sell_token = result.owner_address, result.sell_token
+
+        def on_settled(success):
+            if success and amount == MAX_UINT256:
+                self.allowance_cache.put(owner_address, sell_token,
+                                         self.spender, amount)
+            else:
+                self.forget_allowance(owner_address, sell_token)
+            if not success:
+                self.nonce_manager.reset(owner_address)
+
+        self.forget_allowance(owner_address, sell_token)
+        self.settlement_tracker.watch(Web3.to_hex(tx_hash), on_settled)
+        result.allowance = amount
+        return tx_hash
+
+    def record_swap(self, owner_address, sell_token, amount_in):
+        """Account for a sent swap spending ``amount_in`` of the allowance."""
+        if not is_native(sell_token):
+            self.allowance_cache.spend(owner_address, sell_token, self.spender,
+                                       amount_in)
+
+    def forget_allowance(self, owner_address, sell_token):
+        self.allowance_cache.invalidate(owner_address, sell_token,
+                                        self.spender)
+
+    async def quote(self, result, slippage):
+        """
+        Fetch metasolver routes for a prepared result, pick the one with the
+        best output after gas and compute its price impact.
+        """
+        slippages = [slippage] + [
+            level for level in self.slippage_levels
+            if float(level) < float(slippage)
+        ]
+        responses = await asyncio.gather(*[
+            self.quote_cache.get(
+                quote_params(result.sell_token, result.buy_token,
+                             result.amount_in, level, result.owner_address,
+                             self.chain_id)) for level in slippages
+        ], return_exceptions=True)
+        if isinstance(responses[0], Exception):
+            raise responses[0]
+
+        buy_price = Decimal(result.buy_market['priceUSD'])
+        ranked = []
+        for level, response in zip(slippages, responses):
+            if isinstance(response, Exception):
+                continue
+            for route in response.get('quotes') or []:
+                amount_out = Decimal(route['amountOut']) / Decimal(
+                    10**result.buy_decimals)
+                net_value = amount_out * buy_price - route_gas_cost_usd(
+                    route, result.gas_price, result.eth_market)
+                ranked.append((net_value, level, route))
+        if not ranked:
+            raise QuoteError("No routes found for this trade.")
+        # Stable sort keeps the metasolver's order between equal routes
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+
+        _, result.slippage, result.route = ranked[0]
+        result.ranked_routes = ranked
+        result.amount_out = Decimal(result.route['amountOut']) / Decimal(
+            10**result.buy_decimals)
+        result.price_impact = round(
+            (result.buy_value_usd / result.sell_value_usd - 1) * 100, 2)
+        return result
+
+    async def prefetch(self, owner_address, sell_token, buy_token, amounts,
+                       slippage):
+        """Start background quotes for ``amounts`` (token units) of the sell token."""
+        if is_native(sell_token):
+            sell_decimals = 18
+        else:
+            reads = ReadBatch(self.rpc_pool)
+            decimals_read = self.token_metadata.read_decimals(
+                reads, sell_token)
+            await reads.execute()
+            sell_decimals = decimals_read.value
+            if sell_decimals is None:
+                return
+        self.quote_cache.prefetch([
+            quote_params(sell_token, buy_token,
+                         to_base_units(amount, sell_decimals), slippage,
+                         owner_address, self.chain_id) for amount in amounts
+            if amount > 0
+        ])
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from web3 import AsyncWeb3
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean "this endpoint is unhealthy", as opposed to reverts or
+# invalid requests which would fail the same way on every endpoint.
+TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+
+class RpcError(Exception):
+    """Raised when a raw JSON-RPC request returns an error object."""
+
+
+class RpcEndpoint:
+    def __init__(self, url):
+        self.url = url
+        # Only the host is logged: provider URLs usually embed an API key.
+        self.name = url.split('/')[2] if '://' in url else url
+        self.w3 = None
+        self.failed_until = 0.0
+
+    def is_healthy(self):
+        return time.monotonic() >= self.failed_until
+
+
+class RpcPool:
+    def __init__(self,
+                 endpoints,
+                 max_concurrency=32,
+                 request_timeout=10,
+                 cooldown=30,
+                 keepalive_timeout=60):
+        """
+        Process-wide pool of AsyncWeb3 clients sharing one keep-alive HTTP session,
+        with bounded concurrency and failover across the configured RPC endpoints.
+        """
+        if not endpoints:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = [RpcEndpoint(url) for url in endpoints]
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.cooldown = cooldown
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._semaphore = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if self._session is not None:
+                return
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            for endpoint in self.endpoints:
+                provider = AsyncWeb3.AsyncHTTPProvider(
+                    endpoint.url, exception_retry_configuration=None)
+                await provider.cache_async_session(self._session)
+                endpoint.w3 = AsyncWeb3(provider)
+            logger.info(f"RPC pool started with {len(self.endpoints)} endpoint(s)")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _ordered_endpoints(self):
+        # Healthy endpoints first, in configured order; cooling-down ones are
+        # still tried as a last resort rather than failing outright.
+        healthy = [e for e in self.endpoints if e.is_healthy()]
+        cooling = sorted((e for e in self.endpoints if not e.is_healthy()),
+                         key=lambda e: e.failed_until)
+        return healthy + cooling
+
+    async def _with_failover(self, fn):
+        if self._session is None:
+            await self.start()
+        last_error = None
+        async with self._semaphore:
+            for endpoint in self._ordered_endpoints():
+                try:
+                    result = await asyncio.wait_for(fn(endpoint),
+                                                    self.request_timeout)
+                    endpoint.failed_until = 0.0
+                    return result
+                except TRANSPORT_ERRORS as e:
+                    logger.warning(f"RPC endpoint {endpoint.name} failed: {e!r}")
+                    endpoint.failed_until = time.monotonic() + self.cooldown
+                    last_error = e
+        raise last_error
+
+    async def call(self, fn):
+        """Run ``fn(w3)`` on the first healthy endpoint, failing over on transport errors."""
+        return await self._with_failover(lambda endpoint: fn(endpoint.w3))
+
+    async def _post_batch(self, endpoint, payload):
+        async with self._session.post(endpoint.url, json=payload) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def request_batch(self, calls, allow_errors=False):
+        """
+        Send ``[(method, params), ...]`` as a single JSON-RPC batch request.
+
+        :param allow_errors: Return None for a call that failed instead of
+            raising, e.g. when a provider rejects part of the batch
+        :return: The decoded ``result`` of every call, in request order
+        """
+        payload = [{
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": method,
+            "params": params
+        } for i, (method, params) in enumerate(calls)]
+        replies = await self._with_failover(
+            lambda endpoint: self._post_batch(endpoint, payload))
+        if not isinstance(replies, list):
+            # Endpoints without batch support answer with a single error object
+            raise RpcError(replies.get('error', replies))
+
+        replies_by_id = {reply.get('id'): reply for reply in replies}
+        results = []
+        for i, (method, _) in enumerate(calls):
+            reply = replies_by_id.get(i)
+            if reply is None or 'error' in reply:
+                if allow_errors:
+                    results.append(None)
+                    continue
+                raise RpcError(
+                    f"{method} failed: {reply.get('error') if reply else 'no reply'}")
+            results.append(reply['result'])
+        return results
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+
+from .background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def transaction_link(tx_hash):
+    return f"https://basescan.org/tx/{tx_hash}"
+
+
+class PendingTransaction:
+    def __init__(self,
+                 tx_hash,
+                 chat_id,
+                 message_id,
+                 success_text,
+                 failure_text,
+                 on_settled=None):
+        self.tx_hash = tx_hash
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.success_text = success_text
+        self.failure_text = failure_text
+        self.on_settled = on_settled
+        self.submitted_at = time.monotonic()
+
+
+class SettlementTracker(PeriodicTask):
+    task_name = "Settlement poll"
+
+    def __init__(self, rpc_pool, poll_interval=2, timeout=600, batch_size=20):
+        """
+        Follows submitted transactions in the background and edits the user's
+        "pending" message once each one is confirmed or reverted. Receipts for
+        every pending transaction are fetched each round in JSON-RPC batches
+        of at most ``batch_size``; a receipt that could not be fetched counts
+        as not mined yet, so the timeout still applies.
+
+        Message texts may contain ``{link}``, replaced with the explorer link.
+        An ``on_settled(success)`` callback is called with True once the
+        transaction is confirmed, False if it reverted and None if it is still
+        not mined after ``timeout`` seconds.
+        """
+        self.rpc_pool = rpc_pool
+        self.interval = poll_interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.bot = None
+        self._pending = {}
+        self._background = set()
+
+    def start(self, bot):
+        self.bot = bot
+        super().start()
+
+    async def stop(self):
+        await super().stop()
+        # Awaited operations (CDP polls) must not outlive the bot and store
+        background = list(self._background)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+    def track(self,
+              tx_hash,
+              chat_id,
+              message_id,
+              success_text,
+              failure_text,
+              on_settled=None):
+        """Watch an already broadcast transaction by hash."""
+        self._pending[tx_hash] = PendingTransaction(tx_hash, chat_id,
+                                                    message_id, success_text,
+                                                    failure_text, on_settled)
+
+    def watch(self, tx_hash, on_settled):
+        """Watch a transaction without a message to update, e.g. an approve."""
+        self._pending[tx_hash] = PendingTransaction(tx_hash, None, None, None,
+                                                    None, on_settled)
+
+    def track_awaitable(self, awaitable, chat_id, message_id, success_text,
+                        failure_text):
+        """
+        Watch an operation that can only be awaited, e.g. polling a CDP
+        transfer whose hash is not known yet. It must return the tx hash.
+        """
+        async def settle():
+            try:
+                tx_hash = await awaitable
+                text = success_text.format(link=transaction_link(tx_hash))
+            except Exception as e:
+                text = failure_text.format(link="", error=str(e))
+            await self._edit(chat_id, message_id, text)
+
+        task = asyncio.create_task(settle())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _edit(self, chat_id, message_id, text):
+        if chat_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(text,
+                                             chat_id=chat_id,
+                                             message_id=message_id)
+        except Exception as e:
+            logger.error(f"Failed to update settlement message: {e}")
+
+    async def run_once(self):
+        if self._pending:
+            await self._poll()
+
+    async def _fetch_receipts(self, pending):
+        try:
+            return await self.rpc_pool.request_batch(
+                [("eth_getTransactionReceipt", [tx.tx_hash])
+                 for tx in pending],
+                allow_errors=True)
+        except Exception as e:
+            logger.warning(f"Fetching {len(pending)} receipts failed: {e!r}")
+            return [None] * len(pending)
+
+    async def _poll(self):
+        pending = list(self._pending.values())
+        chunks = await asyncio.gather(*[
+            self._fetch_receipts(pending[i:i + self.batch_size])
+            for i in range(0, len(pending), self.batch_size)
+        ])
+        receipts = [receipt for chunk in chunks for receipt in chunk]
+        for tx, receipt in zip(pending, receipts):
+            link = transaction_link(tx.tx_hash)
+            if receipt is None:
+                if time.monotonic() - tx.submitted_at > self.timeout:
+                    del self._pending[tx.tx_hash]
+                    self._settled(tx, None)
+                    await self._edit(
+                        tx.chat_id, tx.message_id,
+                        f"Transaction still pending, check its status here: {link}")
+                continue
+            del self._pending[tx.tx_hash]
+            success = int(receipt['status'], 16) == 1
+            self._settled(tx, success)
+            if tx.chat_id is None:
+                continue
+            if success:
+                text = tx.success_text.format(link=link)
+            else:
+                text = tx.failure_text.format(link=link, error="reverted")
+            await self._edit(tx.chat_id, tx.message_id, text)
+
+    @staticmethod
+    def _settled(tx, success):
+        if tx.on_settled is None:
+            return
+        try:
+            tx.on_settled(success)
+        except Exception as e:
+            logger.error(f"Settlement callback for {tx.tx_hash} failed: {e!r}")
@@ -0,0 +1,265 @@
+import abc
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class KeyValueStore(abc.ABC):
+    """String keys to string values; the interface every storage backend provides."""
+
+    @abc.abstractmethod
+    def get(self, key, default=None):
+        ...
+
+    @abc.abstractmethod
+    def set(self, key, value):
+        ...
+
+    @abc.abstractmethod
+    def set_if_absent(self, key, value):
+        """Store ``value`` unless ``key`` exists; return whether it was stored."""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        ...
+
+    @abc.abstractmethod
+    def keys(self, prefix=""):
+        ...
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def close(self):
+        pass
+
+
+class SqliteStore(KeyValueStore):
+    def __init__(self, path):
+        """
+        Local key-value table in SQLite with write-ahead logging, so reads do
+        not block on writers and each write is a short append.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL still survives application crashes; only a power
+        # loss can drop the last commits
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL"
+                           ") WITHOUT ROWID")
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ?",
+                                     (key, )).fetchone()
+        return row[0] if row is not None else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO kv (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value))
+
+    def set_if_absent(self, key, value):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO kv (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO NOTHING", (key, value))
+        return cursor.rowcount == 1
+
+    def set_many(self, items):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO kv (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    items)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key, ))
+
+    def delete_many(self, keys):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("DELETE FROM kv WHERE key = ?",
+                                       [(key, ) for key in keys])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def claim(self, prefix, key):
+        """
+        Atomically move one record stored under ``prefix`` to ``key`` and return
+        its old key and value, or None if there is none or ``key`` is taken.
+        """
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes
+            # cannot hand out the same record
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT key, value FROM kv WHERE substr(key, 1, ?) = ? "
+                    "LIMIT 1", (len(prefix), prefix)).fetchone()
+                taken = self._conn.execute("SELECT 1 FROM kv WHERE key = ?",
+                                           (key, )).fetchone()
+                if row is None or taken is not None:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (row[0], ))
+                self._conn.execute("INSERT INTO kv (key, value) VALUES (?, ?)",
+                                   (key, row[1]))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return row[0], row[1]
+
+    def count(self, prefix=""):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM kv WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix)).fetchone()[0]
+
+    def keys(self, prefix=""):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM kv WHERE substr(key, 1, ?) = ? ORDER BY key",
+                (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def items(self, prefix=""):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, value FROM kv WHERE substr(key, 1, ?) = ? "
+                "ORDER BY key", (len(prefix), prefix)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ReplitStore(KeyValueStore):
+    def __init__(self):
+        """The Replit database; only available when running on Replit."""
+        from replit import db
+        if db is None:
+            raise RuntimeError("The Replit database is not configured")
+        self._db = db
+
+    @staticmethod
+    def available():
+        try:
+            from replit import db
+        except ImportError:
+            return False
+        return db is not None
+
+    def get(self, key, default=None):
+        return self._db.get(key, default)
+
+    def set(self, key, value):
+        self._db[key] = value
+
+    def set_if_absent(self, key, value):
+        # The Replit database has no conditional write; this only guards
+        # against requests within this process
+        if key in self._db:
+            return False
+        self._db[key] = value
+        return True
+
+    def delete(self, key):
+        if key in self._db:
+            del self._db[key]
+
+    def keys(self, prefix=""):
+        return sorted(self._db.prefix(prefix))
+
+    def __contains__(self, key):
+        return key in self._db
+
+
+class CachedStore(KeyValueStore):
+    def __init__(self, backend, max_size=10000):
+        """
+        Read-through LRU cache in front of ``backend``. Writes go to the backend
+        first and then to the cache. Missing keys are not cached, so a record
+        written by another process is picked up on the next read.
+        """
+        self.backend = backend
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = self.backend.get(key)
+        if value is None:
+            return default
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+        self._remember(key, value)
+
+    def set_if_absent(self, key, value):
+        stored = self.backend.set_if_absent(key, value)
+        if stored:
+            self._remember(key, value)
+        return stored
+
+    def delete(self, key):
+        self.backend.delete(key)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def claim(self, prefix, key):
+        claimed = self.backend.claim(prefix, key)
+        if claimed is not None:
+            self._remember(key, claimed[1])
+        return claimed
+
+    def count(self, prefix=""):
+        return self.backend.count(prefix)
+
+    def keys(self, prefix=""):
+        return self.backend.keys(prefix)
+
+    def close(self):
+        self.backend.close()
+
+
+def open_store(url):
+    """
+    Open a store from a URL: ``sqlite:///path/to/file.db`` or ``replit:``.
+    """
+    if url.startswith("sqlite:///"):
+        return SqliteStore(url[len("sqlite:///"):])
+    if url.startswith("replit:"):
+        return ReplitStore()
+    raise ValueError(f"Unsupported storage URL: {url}")
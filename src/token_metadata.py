@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from .multicall import BatchCall
+
+logger = logging.getLogger(__name__)
+
+NATIVE_TOKEN_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+WETH_ADDRESS = "0x4200000000000000000000000000000000000006"
+
+
+class TokenMetadataCache:
+    def __init__(self, path="token_metadata.json", chain_id=8453, save_delay=5):
+        """
+        ERC-20 metadata (decimals, symbol, name) keyed by (chainId, address).
+        Decimals never change, so entries are kept forever and persisted to a
+        compact JSON index that is loaded again at startup.
+
+        New entries are written together ``save_delay`` seconds after the
+        first change, in a worker thread; ``flush()`` writes what is left.
+        """
+        self.path = path
+        self.chain_id = chain_id
+        self.save_delay = save_delay
+        self._tokens = {}
+        self._dirty = False
+        self._save_handle = None
+        self._save_task = None
+        self._write_lock = threading.Lock()
+        self._seed()
+
+    def _seed(self):
+        self._tokens[(self.chain_id, NATIVE_TOKEN_ADDRESS)] = (18, "ETH", "Ether")
+        self._tokens[(self.chain_id, WETH_ADDRESS)] = (18, "WETH", "Wrapped Ether")
+
+    @staticmethod
+    def _key(chain_id, address):
+        return (int(chain_id), address.lower())
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as file:
+                stored = json.load(file)
+            for key, (decimals, symbol, name) in stored.items():
+                chain_id, address = key.split(":")
+                # Skips bad decimals saved before they were validated
+                self._merge(self._key(chain_id, address), int(decimals), symbol,
+                            name)
+            logger.info(f"Loaded metadata for {len(stored)} tokens from {self.path}")
+        except Exception as e:
+            logger.error(f"Error reading {self.path}: {e}")
+
+    def _snapshot(self):
+        self._dirty = False
+        return {
+            f"{chain_id}:{address}": list(entry)
+            for (chain_id, address), entry in self._tokens.items()
+        }
+
+    def _write(self, stored):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with self._write_lock:
+                with open(tmp_path, "w") as file:
+                    json.dump(stored, file, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving {self.path}: {e}")
+
+    def save(self):
+        self._write(self._snapshot())
+
+    def flush(self):
+        """Write pending changes now, e.g. at shutdown."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._dirty:
+            self.save()
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. a script): nothing to batch with
+            self.save()
+            return
+        self._save_handle = loop.call_later(self.save_delay, self._save_later)
+
+    def _save_later(self):
+        self._save_handle = None
+        if self._dirty:
+            self._save_task = asyncio.create_task(
+                asyncio.to_thread(self._write, self._snapshot()))
+
+    def get(self, address, chain_id=None):
+        """Return ``(decimals, symbol, name)`` or None if the token is unknown."""
+        return self._tokens.get(self._key(chain_id or self.chain_id, address))
+
+    def decimals(self, address, chain_id=None):
+        entry = self.get(address, chain_id)
+        return entry[0] if entry else None
+
+    def _merge(self, key, decimals, symbol, name):
+        # ERC-20 decimals are a uint8; anything else is a bogus contract or
+        # API result and must not be kept, let alone saved
+        if not 0 <= decimals <= 255:
+            logger.warning(f"Ignoring invalid decimals {decimals} for {key}")
+            return False
+        old = self._tokens.get(key)
+        new = (decimals,
+               symbol if symbol is not None else (old[1] if old else None),
+               name if name is not None else (old[2] if old else None))
+        if new == old:
+            return False
+        self._tokens[key] = new
+        return True
+
+    def put(self, address, decimals, symbol=None, name=None, chain_id=None):
+        if self._merge(self._key(chain_id or self.chain_id, address),
+                       int(decimals), symbol, name):
+            self._mark_dirty()
+
+    def update_from_codex(self, results):
+        """Record metadata from Codex ``filterTokens`` results."""
+        changed = False
+        for result in results:
+            token = result.get("token") or {}
+            if token.get("address") is None or token.get("decimals") is None:
+                continue
+            key = self._key(token.get("networkId") or self.chain_id,
+                            token["address"])
+            changed |= self._merge(key, int(token["decimals"]),
+                                   token.get("symbol"), token.get("name"))
+        if changed:
+            self._mark_dirty()
+
+    def read_decimals(self, reads, address, chain_id=None):
+        """
+        Return a BatchCall for the token's decimals: already resolved when cached,
+        otherwise queued on ``reads`` and recorded here once the batch executes.
+        """
+        decimals = self.decimals(address, chain_id)
+        if decimals is not None:
+            call = BatchCall(None)
+            call.value = decimals
+            return call
+        call = reads.decimals(address)
+        call.on_result = lambda value: self.put(address, value, chain_id=chain_id)
+        return call
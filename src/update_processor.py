@@ -0,0 +1,50 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from .keyed_lock import KeyedLock
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=64, max_pending_updates=4096):
+        """
+        Processes updates concurrently, up to ``max_concurrent_updates`` at a
+        time, while updates from the same chat run one after another in the
+        order they arrived, so one user's taps apply in sequence and a slow
+        handler only delays that user.
+
+        An update takes its chat's lock before a processing slot, so updates
+        queued behind their own chat do not hold slots that other chats could
+        use. The base class limit only caps how many updates may be waiting
+        or running at once (``max_pending_updates``).
+        """
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = KeyedLock()
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        async with self._chat_locks[key]:
+            async with self._slots:
+                await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class WalletSessionCache:
+    def __init__(self, max_size=1024, ttl=900):
+        """
+        In-memory cache of imported CDP wallet addresses per user, so a button
+        click does not repeat the db read, AES decrypt and Wallet.import_data.
+        Entries expire after ``ttl`` seconds and the least recently used entry
+        is evicted once ``max_size`` users are cached. Eviction only drops the
+        cache's reference: handlers may still be using the address (and its
+        signing key) concurrently.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, address = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return address
+
+    def put(self, user_id, address):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.monotonic() + self.ttl, address)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+from .background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+class WalletPool(PeriodicTask):
+    task_name = "Wallet pool refill"
+
+    def __init__(self,
+                 store,
+                 create_wallet,
+                 size=20,
+                 concurrency=4,
+                 interval=30,
+                 prefix="pool:"):
+        """
+        Keeps ``size`` ready-made wallets in ``store`` so a new user is handed
+        one instead of waiting for Wallet.create, export and encryption.
+
+        ``create_wallet()`` is a coroutine returning ``(key, record, address)``:
+        a unique key for the wallet, its encrypted record as stored for users,
+        and the live default address. Records are stored under ``prefix`` and
+        claimed atomically, so each wallet goes to exactly one user. Addresses
+        created by this process are kept in memory and handed out with the
+        record, so a claim needs no import; after a restart the record is
+        imported as for any returning user.
+
+        The pool is topped up every ``interval`` seconds and right after each
+        claim, creating at most ``concurrency`` wallets at a time.
+        """
+        self.store = store
+        self.create_wallet = create_wallet
+        self.size = size
+        self.concurrency = concurrency
+        self.interval = interval
+        self.prefix = prefix
+        self._addresses = {}
+        self._wakeup = asyncio.Event()
+
+    async def run_once(self):
+        self._wakeup.clear()
+        await self.refill()
+
+    async def wait(self):
+        # A drained pool wakes the loop before the interval is up
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+
+    def available(self):
+        return self.store.count(self.prefix)
+
+    async def refill(self):
+        """Create wallets until the pool holds ``size`` of them."""
+        while True:
+            missing = self.size - self.available()
+            if missing <= 0:
+                return
+            batch = min(missing, self.concurrency)
+            results = await asyncio.gather(
+                *(self.create_wallet() for _ in range(batch)),
+                return_exceptions=True)
+            errors = []
+            for result in results:
+                if isinstance(result, BaseException):
+                    errors.append(result)
+                    continue
+                key, record, address = result
+                self.store.set(self.prefix + key, record)
+                self._addresses[self.prefix + key] = address
+            logger.info(f"Wallet pool holds {self.available()}/{self.size}")
+            if errors:
+                # Back off until the next round rather than hammering CDP
+                raise errors[0]
+
+    def claim(self, user_id):
+        """
+        Assign a pooled wallet to ``user_id``. Returns ``(record, address)``,
+        where ``address`` is None unless the wallet was created by this
+        process, or None if the pool is empty.
+        """
+        claimed = self.store.claim(self.prefix, user_id)
+        self._wakeup.set()
+        if claimed is None:
+            return None
+        key, record = claimed
+        return record, self._addresses.pop(key, None)